@@ -1,27 +1,44 @@
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Depends, Query, Response, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from typing import List
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select, delete, literal
 from sqlalchemy.orm import Session
-from collections import defaultdict
-import random
-from typing import Optional
-import httpx 
-from db_models import User as DBUser, Track, Artist, user_likes
-from db_config import SessionLocal
+from typing import Optional, Literal
+from db_models import User as DBUser, Track, Artist, user_likes, user_recommendations
+from db_config import SessionLocal, DB_ASYNC
 from init_db import init_db
-import os
+from schemas import LoginRequest, SongOut, BatchLikeRequest
+from bulk_writes import dialect_insert
+from hydration import hydrate_songs, liked_songs_query, iter_liked_pages, hydration_batcher, MAX_LIKED_PAGE
+from recommendation_state import like_graph, recommend_scored
+from reranking import reranker, track_features, RERANK_POOL
+from item_knn import item_knn
+from track_sampler import track_sampler
+from search_index import search_index
+from cache import (
+    track_cache, recommendation_cache, cached_recommendations, recommendation_variant, invalidate_user,
+    invalidate_catalogue,
+)
+import ml_service
+import metrics
+import shared_state
+from profiler import profiler, PROFILER_TOKEN
 from dotenv import load_dotenv
+import json
 
 load_dotenv
 
-API_URL= os.environ["API_URL"]
 app = FastAPI(
     title="MusicApp API",
     description="Simple music app with liked songs and recommendations",
     version="1.0.0",
+    default_response_class=metrics.TimedJSONResponse,
 )
 
+if metrics.METRICS_ENABLED:
+    app.middleware("http")(metrics.middleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -30,9 +47,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if DB_ASYNC:
+    from async_routes import router as async_router
+    app.include_router(async_router)
+
 @app.on_event("startup")
 def startup():
     init_db()
+    # With a published snapshot the worker maps it instead of reading every like.
+    attached = bool(shared_state.SHARED_STATE_DIR) and shared_state.attach_latest()
+    db = SessionLocal()
+    try:
+        if not attached:
+            like_graph.load(db)
+            track_sampler.load(db)
+            track_features.load(db)
+    finally:
+        db.close()
+    # In shared mode the publisher rebuilds the index and the watcher reloads it.
+    item_knn.shared = bool(shared_state.SHARED_STATE_DIR)
+    item_knn.load()
+    if item_knn.stale():
+        item_knn.rebuild_in_background(like_graph)
+    if not attached:
+        search_index.rebuild_in_background(SessionLocal)
+    if shared_state.SHARED_STATE_DIR:
+        shared_state.watch()
+    ml_service.load()
+
+@app.on_event("startup")
+async def start_ml_service():
+    await ml_service.start()
+
+@app.on_event("shutdown")
+async def stop_ml_service():
+    await ml_service.stop()
 
 # Dependency
 def get_db():
@@ -42,26 +91,6 @@ def get_db():
     finally:
         db.close()
 
-class LoginRequest(BaseModel):
-    username: str
-
-class SongOut(BaseModel):
-    id: float
-    title: str
-    link: str
-    duration: int
-    preview: str
-    position: Optional[float] = None
-    rank: float
-    explicit_lyrics: bool
-    album_id: float
-    album_title: str
-    album_cover: str
-    artist_id: float
-
-    class Config:
-        orm_mode = True
-
 
 @app.post("/login")
 def login(data: LoginRequest, db: Session = Depends(get_db)):
@@ -80,113 +109,258 @@ def login(data: LoginRequest, db: Session = Depends(get_db)):
 
 
 @app.get("/songs", response_model=List[SongOut], tags=["Songs"])
-def list_all_songs(db: Session = Depends(get_db)):
-    all_songs = db.query(Track).all()
-    if not all_songs:
+def list_all_songs(seed: Optional[int] = None, weighted: bool = False, db: Session = Depends(get_db)):
+    track_ids = track_sampler.sample(db, 10, seed=seed, weighted=weighted)
+    if not track_ids:
         raise HTTPException(status_code=404, detail="No songs in database")
-    return random.sample(all_songs, min(10, len(all_songs)))
+    return hydrate_songs(db, track_ids)
+
+
+@app.get("/search", response_model=List[SongOut], tags=["Songs"])
+def search_songs(
+    query: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    prefix: bool = True,
+    db: Session = Depends(get_db),
+):
+    """Typeahead search over title, artist and album, ranked by similarity and popularity."""
+    if search_index.stale():
+        search_index.rebuild_in_background(SessionLocal)
+    if search_index.ready:
+        track_ids = search_index.search(query, limit, offset, prefix)
+    else:
+        # Index still building after startup: plain substring match on titles, with the
+        # user's % and _ matched literally.
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        track_ids = db.execute(
+            select(Track.id).where(Track.title.ilike(f"%{escaped}%", escape="\\"))
+            .order_by(Track.rank.desc()).offset(offset).limit(limit)
+        ).scalars().all()
+    return hydrate_songs(db, track_ids)
+
+
+def _stream_liked_ndjson(username: str, cursor: Optional[int], limit: Optional[int]):
+    # The request-scoped session is closed before a streaming body is sent; use our own.
+    db = SessionLocal()
+    try:
+        for page in iter_liked_pages(db, username, cursor, limit):
+            yield "".join(json.dumps(song) + "\n" for song in page)
+    finally:
+        db.close()
 
 
 @app.get("/liked/{username}", response_model=List[SongOut], tags=["Likes"])
-def get_liked_songs(username: str, db: Session = Depends(get_db)):
-    user = db.query(DBUser).filter(DBUser.username == username).first()
-    if not user or not user.liked_songs:
-        return []
-    return user.liked_songs
+def get_liked_songs(
+    username: str,
+    response: Response,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIKED_PAGE),
+    fmt: Literal["json", "ndjson"] = Query("json", alias="format"),
+    db: Session = Depends(get_db),
+):
+    if fmt == "ndjson":
+        return StreamingResponse(
+            _stream_liked_ndjson(username, cursor, limit), media_type="application/x-ndjson"
+        )
+    songs = [row._asdict() for row in db.execute(liked_songs_query(username, cursor, limit))]
+    if limit and len(songs) == limit:
+        response.headers["X-Next-Cursor"] = str(songs[-1]["id"])
+    return songs
+
+
+MAX_BATCH_LIKES = 1000
+
+
+def _require_user(db: Session, username: str):
+    if db.query(DBUser.id).filter(DBUser.username == username).first() is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+
+def _drop_materialized(db: Session, username: str):
+    # Likes changed: serve live scores until the next materialization covers them.
+    db.execute(delete(user_recommendations).where(user_recommendations.c.username == username))
+
+
+def _like_many(db: Session, username: str, song_ids):
+    """Idempotent insert of likes for existing tracks; returns the newly liked ids."""
+    stmt = dialect_insert(db, user_likes).from_select(
+        ["username", "song_id"],
+        select(literal(username), Track.id).where(Track.id.in_(song_ids)),
+    ).on_conflict_do_nothing().returning(user_likes.c.song_id)
+    liked = list(db.execute(stmt).scalars())
+    if liked:
+        _drop_materialized(db, username)
+    db.commit()
+    for song_id in liked:
+        like_graph.add_like(username, song_id)
+    if liked:
+        invalidate_user(username)
+        item_knn.record_changes(len(liked))
+    return liked
+
+
+def _unlike_many(db: Session, username: str, song_ids):
+    stmt = delete(user_likes).where(
+        user_likes.c.username == username, user_likes.c.song_id.in_(song_ids)
+    ).returning(user_likes.c.song_id)
+    removed = list(db.execute(stmt).scalars())
+    if removed:
+        _drop_materialized(db, username)
+    db.commit()
+    for song_id in removed:
+        like_graph.remove_like(username, song_id)
+    if removed:
+        invalidate_user(username)
+        item_knn.record_changes(len(removed))
+    return removed
+
+
+def _check_batch(data: BatchLikeRequest):
+    if len(data.song_ids) > MAX_BATCH_LIKES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_LIKES} songs per batch")
+
+
+@app.post("/like/batch/{username}", tags=["Likes"])
+def like_songs(username: str, data: BatchLikeRequest, db: Session = Depends(get_db)):
+    _check_batch(data)
+    _require_user(db, username)
+    liked = _like_many(db, username, data.song_ids)
+    return {"message": f"{len(liked)} songs liked by {username}", "liked": liked}
+
+
+@app.post("/unlike/batch/{username}", tags=["Likes"])
+def unlike_songs(username: str, data: BatchLikeRequest, db: Session = Depends(get_db)):
+    _check_batch(data)
+    _require_user(db, username)
+    removed = _unlike_many(db, username, data.song_ids)
+    return {"message": f"{len(removed)} songs unliked by {username}", "unliked": removed}
 
 
 @app.post("/like/{song_id}/user/{username}", tags=["Likes"])
 def like_song(song_id: int, username: str, db: Session = Depends(get_db)):
-    user = db.query(DBUser).filter(DBUser.username == username).first()
-    song = db.query(Track).filter(Track.id == song_id).first()
+    user = db.query(DBUser.id).filter(DBUser.username == username).first()
+    song = db.query(Track.id).filter(Track.id == song_id).first()
 
     if not user or not song:
         raise HTTPException(status_code=404, detail="User or Song not found")
 
-    if song not in user.liked_songs:
-        user.liked_songs.append(song)
-        db.commit()
+    _like_many(db, username, [song_id])
 
     return {"message": f"Song {song_id} liked by {username}"}
 
 
 @app.post("/unlike/{song_id}/user/{username}", tags=["Likes"])
 def unlike_song(song_id: int, username: str, db: Session = Depends(get_db)):
-    user = db.query(DBUser).filter(DBUser.username == username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    user.liked_songs = [s for s in user.liked_songs if s.id != song_id]
-    db.commit()
+    _require_user(db, username)
+    _unlike_many(db, username, [song_id])
 
     return {"message": f"Song {song_id} unliked by {username}"}
 
 
 @app.delete("/artist/{artist_id}", tags=["Artists"])
 def delete_artist_and_songs(artist_id: int, db: Session = Depends(get_db)):
-    artist = db.query(Artist).filter(Artist.id == artist_id).first()
-    if not artist:
+    if db.query(Artist.id).filter(Artist.id == artist_id).first() is None:
         raise HTTPException(status_code=404, detail="Artist not found")
 
+    artist_tracks = select(Track.id).where(Track.artist_id == artist_id)
     # Remove likes to tracks by this artist
-    for track in artist.tracks:
-        db.execute(user_likes.delete().where(user_likes.c.song_id == track.id))
+    db.execute(delete(user_likes).where(user_likes.c.song_id.in_(artist_tracks)))
     # Delete tracks and artist
-    for track in artist.tracks:
-        db.delete(track)
-    db.delete(artist)
+    track_ids = list(db.execute(
+        delete(Track).where(Track.artist_id == artist_id).returning(Track.id)
+    ).scalars())
+    db.execute(delete(Artist).where(Artist.id == artist_id))
     db.commit()
+    like_graph.remove_songs(track_ids)
+    track_sampler.invalidate()
+    track_features.invalidate()
+    search_index.invalidate()
+    invalidate_catalogue()
     return {"message": f"Artist {artist_id} and all their songs removed."}
 
 
 @app.get("/recommendations/{username}", response_model=List[SongOut])
-def recommend_songs(username: str, top_n: int = 5, db: Session = Depends(get_db)):
-    try:
-        users = db.query(DBUser).all()
-        user_likes_map = defaultdict(set)
+def recommend_songs(
+    username: str,
+    top_n: int = 5,
+    algorithm: Literal["user", "item"] = "user",
+    explicit: bool = True,
+    db: Session = Depends(get_db),
+):
+    def compute():
+        like_graph.ensure_loaded(db)
+        ranked = recommend_scored(username, max(top_n, RERANK_POOL), algorithm)
+        return reranker.rerank(track_features.current(db), [s for s, _ in ranked], [x for _, x in ranked],
+                               top_n, explicit)
 
-        for user in users:
-            for song in user.liked_songs:
-                user_likes_map[user.username].add(song.id)
-
-        if username not in user_likes_map:
-            return []
-
-        target_likes = user_likes_map[username]
-        scores = defaultdict(float)
-
-        for other_user, other_likes in user_likes_map.items():
-            if other_user == username:
-                continue
-            intersection = len(target_likes & other_likes)
-            union = len(target_likes | other_likes)
-            similarity = intersection / union if union else 0
-            for song_id in other_likes - target_likes:
-                scores[song_id] += similarity
-
-        top_song_ids = [song_id for song_id, _ in sorted(scores.items(), key=lambda x: -x[1])[:top_n]]
+    try:
+        top_song_ids = cached_recommendations(username, recommendation_variant(algorithm, top_n, explicit), compute)
         if not top_song_ids:
             print("Error to retrieve recommendation songs")
             return []
 
-        return db.query(Track).filter(Track.id.in_(top_song_ids)).all()
+        return hydrate_songs(db, top_song_ids)
     except Exception as e:
         print("Error to retrieve recommendation songs")
         return []
 
 @app.get("/ml-recommendations/{username}", response_model=List[SongOut], tags=["ML Recommendations"])
-def ml_recommend_songs(username: str, top_k: int = 10, db: Session = Depends(get_db)):
+def ml_recommend_songs(username: str, top_k: int = 10, explicit: bool = True, db: Session = Depends(get_db)):
+    def compute():
+        like_graph.ensure_loaded(db)
+        track_ids = ml_service.recommend_track_ids(username, top_k, db, RERANK_POOL)
+        return reranker.rerank(track_features.current(db), track_ids, None, top_k, explicit)
+
     try:
-        api2_url = f"{API_URL}/recommend/{username}?top_k={top_k}"
-        response = httpx.get(api2_url)
-        response.raise_for_status()
-        data = response.json()
-        track_ids = data.get("recommended_track_ids", [])
+        track_ids = cached_recommendations(username, recommendation_variant("ml", top_k, explicit), compute)
     except Exception as e:
         return []
 
     if not track_ids:
         return []
 
-    songs = db.query(Track).filter(Track.id.in_(track_ids)).all()
-    return songs
\ No newline at end of file
+    return hydrate_songs(db, track_ids)
+
+
+@app.get("/stats/inference", tags=["ML Recommendations"])
+def inference_stats():
+    return ml_service.stats()
+
+
+@app.get("/stats/cache", tags=["Songs"])
+def cache_stats():
+    return {
+        "tracks": track_cache.stats(),
+        "recommendations": recommendation_cache.stats(),
+        "hydration": hydration_batcher.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Monitoring"])
+def prometheus_metrics():
+    # Per process: with several uvicorn workers each one reports its own series.
+    return metrics.render()
+
+
+def _require_profiler_token(x_profiler_token: str = Header("")):
+    if not PROFILER_TOKEN or x_profiler_token != PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+
+
+@app.post("/debug/profiler/start", tags=["Monitoring"], dependencies=[Depends(_require_profiler_token)])
+def start_profiler(interval_ms: float = Query(5, ge=1, le=1000)):
+    return {"started": profiler.start(interval_ms), **profiler.status()}
+
+
+@app.post("/debug/profiler/stop", response_class=PlainTextResponse, tags=["Monitoring"],
+          dependencies=[Depends(_require_profiler_token)])
+def stop_profiler():
+    """Stop sampling and return the collapsed stacks."""
+    profiler.stop()
+    return profiler.collapsed()
+
+
+@app.get("/debug/profiler", tags=["Monitoring"], dependencies=[Depends(_require_profiler_token)])
+def profiler_status():
+    return profiler.status()
@@ -1,6 +1,7 @@
 import requests
 from sqlalchemy.orm import Session
-from db_models import Artist
+from cache import invalidate_catalogue
+from bulk_writes import upsert_artists
 from db_config import SessionLocal
 from init_db import init_db
 import re
@@ -21,16 +22,8 @@ def contains_cyrillic(text: str) -> bool:
 def save_artists_to_db(artists: list, db: Session):
     filtered = [a for a in artists if not contains_cyrillic(a['name'])]
 
-    for artist in filtered:
-        db_artist = Artist(
-            id=artist['id'],
-            name=artist['name']
-        )
-        existing = db.query(Artist).filter_by(id=db_artist.id).first()
-        if not existing:
-            db.add(db_artist)
-
-    db.commit()
+    upsert_artists(db, [{"id": a['id'], "name": a['name']} for a in filtered])
+    invalidate_catalogue()
     print(f"Saved {len(filtered)} artists (excluded {len(artists) - len(filtered)} by filter).")
 
 
@@ -0,0 +1,100 @@
+from typing import List, Literal, Optional
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from db_config import AsyncSessionLocal
+from schemas import SongOut
+from hydration import hydrate_songs_async, liked_songs_query, iter_liked_pages_async, MAX_LIKED_PAGE
+from recommendation_state import recommend_scored
+from reranking import reranker, track_features, RERANK_POOL
+from track_sampler import track_sampler
+from cache import cached_recommendations_async, recommendation_variant
+import ml_service
+
+# Non-blocking versions of the read endpoints, used when DB_ASYNC=1. app.py includes this
+# router before declaring its sync routes, so these handlers take precedence.
+router = APIRouter()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+@router.get("/songs", response_model=List[SongOut], tags=["Songs"])
+async def list_all_songs_async(seed: Optional[int] = None, weighted: bool = False,
+                               db=Depends(get_async_db)):
+    track_ids = await track_sampler.sample_async(db, 10, seed=seed, weighted=weighted)
+    if not track_ids:
+        raise HTTPException(status_code=404, detail="No songs in database")
+    return await hydrate_songs_async(db, track_ids)
+
+
+@router.get("/liked/{username}", response_model=List[SongOut], tags=["Likes"])
+async def get_liked_songs_async(
+    username: str,
+    response: Response,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIKED_PAGE),
+    fmt: Literal["json", "ndjson"] = Query("json", alias="format"),
+    db=Depends(get_async_db),
+):
+    if fmt == "ndjson":
+        return StreamingResponse(
+            _stream_liked_ndjson(username, cursor, limit), media_type="application/x-ndjson"
+        )
+    result = await db.execute(liked_songs_query(username, cursor, limit))
+    songs = [row._asdict() for row in result]
+    if limit and len(songs) == limit:
+        response.headers["X-Next-Cursor"] = str(songs[-1]["id"])
+    return songs
+
+
+async def _stream_liked_ndjson(username: str, cursor: Optional[int], limit: Optional[int]):
+    async with AsyncSessionLocal() as db:
+        async for page in iter_liked_pages_async(db, username, cursor, limit):
+            yield "".join(json.dumps(song) + "\n" for song in page)
+
+
+@router.get("/recommendations/{username}", response_model=List[SongOut])
+async def recommend_songs_async(
+    username: str,
+    top_n: int = 5,
+    algorithm: Literal["user", "item"] = "user",
+    explicit: bool = True,
+    db=Depends(get_async_db),
+):
+    async def compute():
+        # Scoring is CPU-bound; keep it off the event loop.
+        ranked = await run_in_threadpool(recommend_scored, username, max(top_n, RERANK_POOL), algorithm)
+        features = await track_features.current_async(db)
+        return reranker.rerank(features, [s for s, _ in ranked], [x for _, x in ranked], top_n, explicit)
+
+    try:
+        top_song_ids = await cached_recommendations_async(username, recommendation_variant(algorithm, top_n, explicit), compute)
+        if not top_song_ids:
+            return []
+        return await hydrate_songs_async(db, top_song_ids)
+    except Exception as e:
+        print("Error to retrieve recommendation songs")
+        return []
+
+
+@router.get("/ml-recommendations/{username}", response_model=List[SongOut], tags=["ML Recommendations"])
+async def ml_recommend_songs_async(username: str, top_k: int = 10, explicit: bool = True,
+                                   db=Depends(get_async_db)):
+    async def compute():
+        track_ids = await ml_service.recommend_track_ids_async(username, top_k, db, RERANK_POOL)
+        features = await track_features.current_async(db)
+        return reranker.rerank(features, track_ids, None, top_k, explicit)
+
+    try:
+        track_ids = await cached_recommendations_async(username, recommendation_variant("ml", top_k, explicit), compute)
+    except Exception as e:
+        return []
+
+    if not track_ids:
+        return []
+
+    return await hydrate_songs_async(db, track_ids)
@@ -0,0 +1,114 @@
+"""Recall@k and latency of the RecVAE ANN index against exact scoring.
+
+    python benchmarks/bench_ann.py --tracks 50000 --users 200 --nprobe 8 16 32 64
+    python benchmarks/bench_ann.py --model-dir model   # a trained model instead
+
+The nprobe calibrated by export_ann for ANN_TARGET_RECALL is always included; the
+recall/latency table goes to stderr, the full report to stdout.
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recvae_ann import RecVAEANN, export_ann
+from recvae_inference import RecVAE, RecVAEScorer
+
+
+def synthetic_model(model_dir: str, n_tracks: int, n_clusters: int = 256, seed: int = 0):
+    """Untrained RecVAE whose item vectors are clustered, like a trained decoder's."""
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    model = RecVAE(n_tracks)
+    out = model.decoder[3]
+    centres = rng.normal(size=(n_clusters, out.weight.shape[1])).astype(np.float32)
+    vectors = centres[rng.integers(n_clusters, size=n_tracks)]
+    vectors += 0.5 * rng.normal(size=vectors.shape).astype(np.float32)
+    with torch.no_grad():
+        out.weight.copy_(torch.from_numpy(vectors * 0.1))
+    torch.save(model.state_dict(), os.path.join(model_dir, "recvae_model.pt"))
+    with open(os.path.join(model_dir, "recvae_metadata.pkl"), "wb") as f:
+        pickle.dump({"track_ids": list(range(1, n_tracks + 1))}, f)
+
+
+def percentile(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--tracks", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--likes", type=int, default=30)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32, 64, 128])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = args.model_dir or tmp
+        if not args.model_dir:
+            synthetic_model(model_dir, args.tracks)
+        ann_dir = os.path.join(tmp, "ann")
+        started = time.perf_counter()
+        export_ann(model_dir, ann_dir, args.lists)
+        build_seconds = time.perf_counter() - started
+
+        exact = RecVAEScorer(model_dir)
+        exact.load()
+        ann = RecVAEANN(ann_dir, nprobe=0)
+        ann.load()
+        calibrated = ann.nprobe
+
+        track_ids = exact._state[1]
+        rng = np.random.default_rng(1)
+        users = [set(rng.choice(track_ids, size=args.likes, replace=False).tolist())
+                 for _ in range(args.users)]
+
+        truth, exact_times = [], []
+        for liked in users:
+            started = time.perf_counter()
+            truth.append(set(exact.recommend(liked, args.k)))
+            exact_times.append(time.perf_counter() - started)
+
+        report = {
+            "tracks": len(track_ids),
+            "build_seconds": round(build_seconds, 2),
+            "lists": len(ann._state[0].half_norms),
+            "calibrated_nprobe": calibrated,
+            "exact": {"p50_ms": percentile(exact_times, 50), "p99_ms": percentile(exact_times, 99)},
+            "ann": [],
+        }
+        print(f"exact: p50 {report['exact']['p50_ms']}ms, p99 {report['exact']['p99_ms']}ms", file=sys.stderr)
+        for nprobe in sorted(set(args.nprobe + [calibrated])):
+            ann.nprobe = nprobe
+            hits, times = 0, []
+            for liked, expected in zip(users, truth):
+                started = time.perf_counter()
+                found = ann.recommend(liked, args.k)
+                times.append(time.perf_counter() - started)
+                hits += len(expected.intersection(found))
+            report["ann"].append({
+                "nprobe": nprobe,
+                f"recall@{args.k}": round(hits / (args.k * len(users)), 4),
+                "p50_ms": percentile(times, 50),
+                "p99_ms": percentile(times, 99),
+            })
+            row = report["ann"][-1]
+            print(f"nprobe {nprobe:4d}{' (calibrated)' if nprobe == calibrated else ''}: "
+                  f"recall@{args.k} {row[f'recall@{args.k}']}, p50 {row['p50_ms']}ms, p99 {row['p99_ms']}ms",
+                  file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark Deezer ingestion against a local stub server.
+
+    python benchmarks/bench_ingestion.py --artists 200 --concurrency 8 --latency-ms 50
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deezer_client import DeezerClient, fetch_tracks_for_artists, run_sync
+
+
+def stub_server(latency_ms: float, tracks_per_artist: int, error_rate: float, page_size: int = 25):
+    """Serve a Deezer-shaped paginated /search on a free local port."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency_ms / 1000)
+            if random.random() < error_rate:
+                self.send_response(random.choice([429, 503]))
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
+
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            name = query.get("q", [""])[0]
+            index = int(query.get("index", ["0"])[0])
+            base = zlib.crc32(name.encode()) * 1000
+            data = [
+                {
+                    "id": base + i, "title": f"{name} #{i}", "link": "", "duration": 180,
+                    "preview": "", "rank": random.randint(1, 10**6), "explicit_lyrics": False,
+                    "album": {"id": base, "title": name, "cover_medium": ""},
+                }
+                for i in range(index, min(index + page_size, tracks_per_artist))
+            ]
+            page = {"data": data, "total": tracks_per_artist}
+            if index + page_size < tracks_per_artist:
+                next_query = urlencode({"q": name, "index": index + page_size})
+                page["next"] = f"http://{self.headers['Host']}/search?{next_query}"
+            body = json.dumps(page).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--artists", type=int, default=200)
+    parser.add_argument("--tracks-per-artist", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=1000, help="token bucket requests/sec")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = stub_server(args.latency_ms, args.tracks_per_artist, args.error_rate)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    artists = [(i, f"artist{i}") for i in range(args.artists)]
+
+    async def run():
+        async with DeezerClient(base_url, rate=args.rate, burst=int(args.rate),
+                                concurrency=args.concurrency) as client:
+            started = time.perf_counter()
+            result = await fetch_tracks_for_artists(artists, client)
+            return client, result, time.perf_counter() - started
+
+    client, result, elapsed = run_sync(run())
+    server.shutdown()
+    print(json.dumps({
+        "artists": len(result),
+        "tracks": sum(len(t) for t in result.values()),
+        "requests": client.requests,
+        "retried": client.retried,
+        "seconds": round(elapsed, 3),
+        "artists_per_sec": round(len(result) / elapsed, 2),
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Startup-to-first-recommendation time: legacy state_dict vs memory-mapped artifact.
+
+    python benchmarks/bench_model_load.py --tracks 100000
+    python benchmarks/bench_model_load.py --model-dir model   # a trained model instead
+
+Each measurement runs in a fresh interpreter so imports and page-cache misses count.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import sys, time, json
+started = time.perf_counter()
+sys.path.insert(0, {api_dir!r})
+from recvae_inference import RecVAEScorer, latest_version, load_artifact, load_scorer
+scorer = RecVAEScorer({model_dir!r})
+if {legacy!r}:
+    net, meta = load_scorer({model_dir!r})
+    scorer._swap(net, meta["track_ids"], None, {model_dir!r})
+else:
+    path = latest_version({model_dir!r})
+    scorer._swap(*load_artifact(path), path)
+loaded = time.perf_counter()
+scorer.recommend(set(scorer._state[1][:20].tolist()), 10)
+done = time.perf_counter()
+print(json.dumps({{"load_s": loaded - started, "first_recommendation_s": done - started}}))
+"""
+
+
+def measure(model_dir: str, legacy: bool) -> dict:
+    code = CHILD.format(api_dir=API_DIR, model_dir=model_dir, legacy=legacy)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    return {k: round(v, 3) for k, v in result.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--tracks", type=int, default=100000)
+    args = parser.parse_args()
+
+    from recvae_inference import MODEL_VERIFY, convert_legacy, latest_version
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = args.model_dir or tmp
+        if not args.model_dir:
+            from bench_ann import synthetic_model
+            synthetic_model(model_dir, args.tracks)
+        if not latest_version(model_dir):
+            started = time.perf_counter()
+            convert_legacy(model_dir)
+            print(f"Converted to a versioned artifact in {time.perf_counter() - started:.2f}s.",
+                  file=sys.stderr)
+        print(json.dumps({
+            "checksums_verified": MODEL_VERIFY,
+            "legacy_state_dict": measure(model_dir, legacy=True),
+            "mmap_artifact": measure(model_dir, legacy=False),
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
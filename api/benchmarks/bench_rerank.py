@@ -0,0 +1,105 @@
+"""Latency and effect of the re-ranking stage on synthetic candidate pools.
+
+    python benchmarks/bench_rerank.py
+    python benchmarks/bench_rerank.py --pools 100 300 1000 --k 10 50 --repeat 2000
+
+Pools are drawn the way a heavy user's candidates look: most tracks from a handful of
+artists, scores skewed toward popular tracks. Reports p50/p99 per rerank() call (feature
+join included) and, against the raw top-k, distinct artists, the largest artist share,
+mean popularity and the fraction of raw relevance kept.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reranking import Reranker
+
+
+def synthetic_features(n_tracks: int, n_artists: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, n_tracks + 1, dtype=np.int64) * 7
+    artists = rng.zipf(1.3, n_tracks) % n_artists
+    popularity = np.log1p(rng.zipf(1.5, n_tracks).astype(np.float64))
+    popularity /= popularity.max()
+    explicit = rng.random(n_tracks) < 0.1
+    return ids, artists.astype(np.int64), popularity, explicit, time.monotonic()
+
+
+def candidate_pool(features, size: int, rng):
+    ids, artists, popularity, _, _ = features
+    favourites = rng.choice(np.unique(artists), size=5, replace=False)
+    own = np.flatnonzero(np.isin(artists, favourites))
+    picks = np.concatenate([
+        rng.choice(own, size=min(len(own), int(size * 0.7)), replace=False),
+        rng.choice(len(ids), size=size, replace=False),
+    ])
+    picks = np.unique(picks)[:size]
+    scores = popularity[picks] + rng.random(len(picks)) * 0.5
+    order = np.argsort(-scores)
+    return ids[picks[order]], scores[order]
+
+
+def describe(features, track_ids, raw_ids, raw_scores):
+    ids, artists, popularity, _, _ = features
+    rows = np.searchsorted(ids, track_ids)
+    _, counts = np.unique(artists[rows], return_counts=True)
+    score_of = dict(zip(raw_ids.tolist(), raw_scores.tolist()))
+    return {
+        "distinct_artists": int(len(counts)),
+        "max_artist_share": round(float(counts.max() / len(track_ids)), 3),
+        "mean_popularity": round(float(popularity[rows].mean()), 3),
+        "relevance_kept": round(sum(score_of[t] for t in track_ids) / float(raw_scores[:len(track_ids)].sum()), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=200000)
+    parser.add_argument("--artists", type=int, default=20000)
+    parser.add_argument("--pools", type=int, nargs="+", default=[100, 300, 500])
+    parser.add_argument("--k", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    features = synthetic_features(args.tracks, args.artists, args.seed)
+    reranker = Reranker()
+    rng = np.random.default_rng(args.seed)
+    report = {
+        "params": {"tracks": args.tracks, "artists": args.artists, "repeat": args.repeat,
+                   "artist_cap": reranker.artist_cap, "diversity": reranker.diversity,
+                   "popularity_penalty": reranker.popularity_penalty},
+        "results": [],
+    }
+    for size in args.pools:
+        pools = [candidate_pool(features, size, rng) for _ in range(50)]
+        for k in args.k:
+            latencies = []
+            for i in range(args.repeat):
+                track_ids, scores = pools[i % len(pools)]
+                started = time.perf_counter()
+                reranker.rerank(features, track_ids, scores, k, allow_explicit=i % 2 == 0)
+                latencies.append(time.perf_counter() - started)
+            track_ids, scores = pools[0]
+            raw = describe(features, track_ids[:k], track_ids, scores)
+            reranked = describe(features, np.array(reranker.rerank(features, track_ids, scores, k)),
+                                track_ids, scores)
+            result = {
+                "pool": size, "k": k,
+                "p50_us": round(float(np.percentile(latencies, 50)) * 1e6, 1),
+                "p99_us": round(float(np.percentile(latencies, 99)) * 1e6, 1),
+                "raw": raw, "reranked": reranked,
+            }
+            report["results"].append(result)
+            print(f"pool={size} k={k}: p50 {result['p50_us']}us, p99 {result['p99_us']}us", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Per-worker startup time and memory: private like graph vs attached shared snapshot.
+
+    python benchmarks/bench_shared_state.py --likes 2000000 --workers 1 2 4 8
+
+Each worker is a fresh interpreter that either loads LikeGraph from the database (what
+every uvicorn worker does today) or attaches the published snapshot, then serves a few
+recommendations. Startup includes interpreter and imports; graph_load is the load or
+attach alone. Memory is reported as RSS and PSS (shared pages split between the
+processes mapping them), read from /proc while all workers are alive.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import sys, time, json
+started = time.perf_counter()
+sys.path.insert(0, {api_dir!r})
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from recommendation_state import LikeGraph, SharedLikeGraph
+imported = time.perf_counter()
+if {shared!r}:
+    import shared_state
+    graph = SharedLikeGraph()
+    path = shared_state.latest_snapshot({state_dir!r})
+    with open(path + "/manifest.json") as f:
+        graph.attach(path, json.load(f)["read_at"])
+else:
+    graph = LikeGraph()
+    db = sessionmaker(bind=create_engine({url!r}))()
+    graph.load(db)
+    db.close()
+loaded = time.perf_counter()
+for u in range(50):
+    graph.top_n(f"user{{u}}", 10)
+print(json.dumps({{"startup_s": loaded - started, "load_s": loaded - imported,
+                  "serve_s": time.perf_counter() - loaded}}), flush=True)
+sys.stdin.read()
+"""
+
+
+def memory_kb(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                fields[parts[0][:-1].lower()] = int(parts[1])
+    return fields
+
+
+def run_workers(n: int, shared: bool, url: str, state_dir: str) -> dict:
+    code = CHILD.format(api_dir=API_DIR, shared=shared, url=url, state_dir=state_dir)
+    procs = [subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, text=True) for _ in range(n)]
+    try:
+        timings = [json.loads(p.stdout.readline()) for p in procs]
+        memory = [memory_kb(p.pid) for p in procs]
+    finally:
+        for p in procs:
+            p.stdin.close()
+            p.wait()
+    return {
+        "startup_s": round(max(t["startup_s"] for t in timings), 3),
+        "graph_load_s": round(max(t["load_s"] for t in timings), 4),
+        "serve_50_users_s": round(max(t["serve_s"] for t in timings), 3),
+        "rss_mb_per_worker": round(sum(m["rss"] for m in memory) / n / 1024, 1),
+        "pss_mb_per_worker": round(sum(m["pss"] for m in memory) / n / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", default=None, help="defaults to a temporary SQLite file")
+    parser.add_argument("--likes", type=int, default=1000000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from bench_recommenders import generate_likes, populate
+    import shared_state
+
+    with tempfile.TemporaryDirectory() as workdir:
+        url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        engine = create_engine(url)
+        n_users, n_tracks = max(10, args.likes // 20), max(200, args.likes // 10)
+        users, tracks, block = generate_likes(n_users, n_tracks, args.likes)
+        populate(engine, n_users, n_tracks, 20, block, users, tracks)
+
+        state_dir = os.path.join(workdir, "state")
+        started = time.perf_counter()
+        shared_state.publish(sessionmaker(bind=engine), state_dir)
+        report = {
+            "params": {"database": engine.dialect.name, "users": n_users, "tracks": n_tracks,
+                       "likes": int(len(users))},
+            "publish_s": round(time.perf_counter() - started, 2),
+            "workers": {},
+        }
+        for n in args.workers:
+            report["workers"][n] = {
+                "private": run_workers(n, False, url, state_dir),
+                "shared": run_workers(n, True, url, state_dir),
+            }
+            print(f"{n} workers: {report['workers'][n]}", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Closed-loop HTTP load test for comparing the sync and async (DB_ASYNC=1) serving modes.
+
+    uvicorn app:app --workers 1 --port 8000                # DB_ASYNC=0, then again with 1
+    python benchmarks/load_test.py --url http://localhost:8000 --users u1,u2 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import httpx
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def run(url: str, paths, concurrency: int, duration: float):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(random.choice(paths))
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+                except httpx.HTTPError:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(1000 * percentile(latencies, 0.50), 2),
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--users", default="", help="comma-separated usernames to query")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--label", default="", help="e.g. sync/async, copied into the output")
+    args = parser.parse_args()
+
+    users = [u for u in args.users.split(",") if u] or ["demo"]
+    paths = ["/songs"]
+    for user in users:
+        paths += [f"/liked/{user}", f"/recommendations/{user}", f"/ml-recommendations/{user}"]
+
+    result = asyncio.run(run(args.url, paths, args.concurrency, args.duration))
+    print(json.dumps({"label": args.label, "concurrency": args.concurrency, **result}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import os
+from sqlalchemy import or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from db_models import Artist, Track
+
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "5000"))
+
+# Columns refreshed when an already-known track comes back from Deezer. artist_id is
+# left alone: the first artist a track was ingested under keeps it.
+TRACK_MUTABLE_COLUMNS = [
+    "title", "link", "duration", "preview", "position", "rank",
+    "explicit_lyrics", "album_id", "album_title", "album_cover",
+]
+
+
+def dialect_insert(db: Session, table):
+    """INSERT construct with on_conflict_* support for the session's backend."""
+    dialect = sqlite if db.get_bind().dialect.name == "sqlite" else postgresql
+    return dialect.insert(table)
+
+
+def _batches(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def bulk_upsert(db: Session, model, rows, update_columns, batch_size: int = BULK_BATCH_SIZE) -> int:
+    """INSERT ... ON CONFLICT (id) DO UPDATE in batches; rows are de-duplicated by id first.
+
+    Only rows whose mutable columns actually changed are rewritten. Returns the number of
+    distinct rows sent.
+    """
+    unique = {}
+    for row in rows:
+        unique.setdefault(row["id"], row)
+    rows = list(unique.values())
+
+    stmt = dialect_insert(db, model)
+    if update_columns:
+        table = model.__table__
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={c: stmt.excluded[c] for c in update_columns},
+            where=or_(*(table.c[c].is_distinct_from(stmt.excluded[c]) for c in update_columns)),
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["id"])
+
+    # executemany: SQLAlchemy folds each batch into multi-row VALUES statements
+    # ("insertmanyvalues") without re-compiling the statement per batch.
+    for batch in _batches(rows, batch_size):
+        db.execute(stmt, batch)
+    db.commit()
+    return len(rows)
+
+
+def upsert_artists(db: Session, artists, batch_size: int = BULK_BATCH_SIZE) -> int:
+    return bulk_upsert(db, Artist, artists, ["name"], batch_size)
+
+
+def upsert_tracks(db: Session, tracks, batch_size: int = BULK_BATCH_SIZE) -> int:
+    return bulk_upsert(db, Track, tracks, TRACK_MUTABLE_COLUMNS, batch_size)
@@ -0,0 +1,266 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+TRACK_CACHE_SIZE = int(os.environ.get("TRACK_CACHE_SIZE", "50000"))
+# With the memory backend every process has its own caches, so invalidate_catalogue()
+# from an ingestion job cannot reach the API workers; their track payloads stay stale
+# until the TTL, hence the shorter default. The Redis backend is shared by all of them.
+TRACK_CACHE_TTL = float(os.environ.get("TRACK_CACHE_TTL") or (3600 if CACHE_BACKEND == "redis" else 300))
+RECS_CACHE_SIZE = int(os.environ.get("RECS_CACHE_SIZE", "10000"))
+RECS_CACHE_TTL = float(os.environ.get("RECS_CACHE_TTL", "60"))
+
+
+class InMemoryCache:
+    """Thread-safe LRU cache with a per-entry TTL.
+
+    `generation()` returns a token that `clear()` and, for a key, `delete()` change;
+    writes given a token are dropped if it changed, so a value computed before an
+    invalidation is never stored after it. Keys share a fixed number of counters, so a
+    collision only costs a skipped write.
+    """
+
+    GENERATION_SLOTS = 4096
+
+    def __init__(self, name: str, max_entries: int, ttl: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._epoch = 0
+        self._generations = [0] * self.GENERATION_SLOTS
+
+    def _generation(self, key=None):
+        if key is None:
+            return (self._epoch,)
+        return self._epoch, self._generations[hash(key) % self.GENERATION_SLOTS]
+
+    def generation(self, key=None):
+        with self._lock:
+            return self._generation(key)
+
+    def get_many(self, keys) -> dict:
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None:
+                    self.misses += 1
+                elif entry[0] < now:
+                    del self._data[key]
+                    self.expirations += 1
+                    self.misses += 1
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    found[key] = entry[1]
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items: dict, ttl: float = None, generation=None, key=None) -> bool:
+        """Store items; with a `generation` token (of `key`, if given) only if still current."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self._generation(key):
+                return False
+            for k, value in items.items():
+                self._data[k] = (expires_at, value)
+                self._data.move_to_end(k)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def set(self, key, value, ttl: float = None, generation=None) -> bool:
+        return self.set_many({key: value}, ttl, generation, key)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._generations[hash(key) % self.GENERATION_SLOTS] += 1
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._epoch += 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class RedisCache:
+    """Redis-compatible backend; values are stored as JSON under `<name>:<key>`.
+
+    Shared by every API worker and by the ingestion jobs, so invalidation reaches all of
+    them. Eviction is left to the server's maxmemory policy. Generation tokens are the
+    counters `<name>.epoch` and `<name>.gen:<key>`, outside the `<name>:*` keys that
+    `clear()` scans, and conditional writes WATCH them.
+    """
+
+    GENERATION_TTL = 86400
+
+    def __init__(self, name: str, ttl: float, url: str = REDIS_URL):
+        import redis
+
+        self.name = name
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key) -> str:
+        return f"{self.name}:{key}"
+
+    def _generation_keys(self, key=None):
+        epoch = f"{self.name}.epoch"
+        return [epoch] if key is None else [epoch, f"{self.name}.gen:{key}"]
+
+    def generation(self, key=None):
+        return tuple(int(v or 0) for v in self._redis.mget(self._generation_keys(key)))
+
+    def get_many(self, keys) -> dict:
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self._redis.mget([self._key(k) for k in keys])
+        found = {k: json.loads(v) for k, v in zip(keys, values) if v is not None}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items: dict, ttl: float = None, generation=None, key=None) -> bool:
+        import redis
+
+        ttl = max(1, int(self.ttl if ttl is None else ttl))
+        if generation is None:
+            pipe = self._redis.pipeline(transaction=False)
+            for k, value in items.items():
+                pipe.set(self._key(k), json.dumps(value), ex=ttl)
+            pipe.execute()
+            return True
+        watched = self._generation_keys(key)
+        with self._redis.pipeline() as pipe:
+            try:
+                pipe.watch(*watched)
+                if tuple(int(v or 0) for v in pipe.mget(watched)) != generation:
+                    return False
+                pipe.multi()
+                for k, value in items.items():
+                    pipe.set(self._key(k), json.dumps(value), ex=ttl)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def set(self, key, value, ttl: float = None, generation=None) -> bool:
+        return self.set_many({key: value}, ttl, generation, key)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.delete(*[self._key(k) for k in keys])
+        for k in keys:
+            counter = self._generation_keys(k)[1]
+            pipe.incr(counter)
+            pipe.expire(counter, self.GENERATION_TTL)
+        pipe.execute()
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def clear(self):
+        self._redis.incr(self._generation_keys()[0])
+        batch = []
+        for key in self._redis.scan_iter(match=f"{self.name}:*", count=1000):
+            batch.append(key)
+            if len(batch) >= 1000:
+                self._redis.delete(*batch)
+                batch = []
+        if batch:
+            self._redis.delete(*batch)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+
+def make_cache(name: str, max_entries: int, ttl: float):
+    if CACHE_BACKEND == "redis":
+        return RedisCache(name, ttl)
+    return InMemoryCache(name, max_entries, ttl)
+
+
+# Serialized SongOut payloads keyed by track id.
+track_cache = make_cache("track", TRACK_CACHE_SIZE, TRACK_CACHE_TTL)
+# Per-user recommendation results: {"<endpoint>:<params>": [track ids]} keyed by username.
+recommendation_cache = make_cache("recs", RECS_CACHE_SIZE, RECS_CACHE_TTL)
+
+
+def recommendation_variant(algorithm: str, n: int, explicit: bool = True) -> str:
+    return f"{algorithm}:{n}" if explicit else f"{algorithm}:{n}:clean"
+
+
+def cached_recommendations(username: str, variant: str, compute):
+    """Return the cached track ids for this user/variant, computing and storing on a miss.
+
+    The user's generation is read before the entry, so a like or unlike landing while
+    the result is computed keeps it (and the entry it was merged into) out of the cache.
+    """
+    generation = recommendation_cache.generation(username)
+    entry = recommendation_cache.get(username) or {}
+    if variant in entry:
+        return entry[variant]
+    track_ids = compute()
+    recommendation_cache.set(username, {**entry, variant: track_ids}, generation=generation)
+    return track_ids
+
+
+async def cached_recommendations_async(username: str, variant: str, compute):
+    generation = recommendation_cache.generation(username)
+    entry = recommendation_cache.get(username) or {}
+    if variant in entry:
+        return entry[variant]
+    track_ids = await compute()
+    recommendation_cache.set(username, {**entry, variant: track_ids}, generation=generation)
+    return track_ids
+
+
+def invalidate_user(username: str):
+    recommendation_cache.delete(username)
+
+
+def invalidate_catalogue():
+    """Called after ingestion or deletions change the tracks table.
+
+    Only reaches other processes with CACHE_BACKEND=redis; see TRACK_CACHE_TTL.
+    """
+    track_cache.clear()
+    recommendation_cache.clear()
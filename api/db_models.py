@@ -1,5 +1,5 @@
 # file: db_models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, Boolean, BigInteger
+from sqlalchemy import Column, Integer, String, ForeignKey, Table, Boolean, BigInteger, DateTime, func, ARRAY, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -9,7 +9,20 @@ Base = declarative_base()
 user_likes = Table(
     'user_likes', Base.metadata,
     Column('username', String, ForeignKey('users.username'), primary_key=True),
-    Column('song_id', Integer, ForeignKey('tracks.id'), primary_key=True)
+    Column('song_id', Integer, ForeignKey('tracks.id'), primary_key=True),
+    # Watermark for incremental training extracts; indexed for "liked since" scans.
+    Column('liked_at', DateTime(timezone=True), server_default=func.now(), index=True)
+)
+
+# Top-N RecVAE track ids per user, bulk-loaded by materialize_recommendations_component.
+# A user's row is deleted when they like or unlike something, which sends them back to
+# live scoring until the next materialization.
+user_recommendations = Table(
+    'user_recommendations', Base.metadata,
+    Column('username', String, primary_key=True),
+    Column('model_version', String, nullable=False),
+    Column('track_ids', ARRAY(BigInteger).with_variant(JSON, 'sqlite'), nullable=False),
+    Column('computed_at', DateTime(timezone=True), server_default=func.now())
 )
 
 class User(Base):
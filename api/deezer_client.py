@@ -0,0 +1,139 @@
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+DEEZER_API_URL = os.environ.get("DEEZER_API_URL", "https://api.deezer.com")
+# Deezer allows 50 requests per 5 seconds per client. A full bucket plus five seconds
+# of refill must fit in that window, so keep DEEZER_BURST + 5 * DEEZER_RATE <= 50.
+DEEZER_RATE = float(os.environ.get("DEEZER_RATE", "9"))
+DEEZER_BURST = int(os.environ.get("DEEZER_BURST", "5"))
+DEEZER_CONCURRENCY = int(os.environ.get("DEEZER_CONCURRENCY", "8"))
+DEEZER_MAX_PAGES = int(os.environ.get("DEEZER_MAX_PAGES", "20"))
+DEEZER_RETRIES = int(os.environ.get("DEEZER_RETRIES", "5"))
+
+QUOTA_EXCEEDED = 4
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, at most `capacity` stored."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self):
+        # Called when Deezer reports the quota as exceeded: start refilling from zero.
+        self.tokens = 0
+        self.updated = time.monotonic()
+
+
+class DeezerClient:
+    """Pooled async Deezer client with rate limiting, retries and `next` pagination."""
+
+    def __init__(self, base_url: str = DEEZER_API_URL, rate: float = DEEZER_RATE,
+                 burst: int = DEEZER_BURST, concurrency: int = DEEZER_CONCURRENCY,
+                 retries: int = DEEZER_RETRIES, transport=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.concurrency = concurrency
+        self.requests = 0
+        self.retried = 0
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            transport=transport,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+
+    async def get_json(self, url: str, params: dict = None) -> dict:
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            self.requests += 1
+            retry_after = None
+            try:
+                response = await self._client.get(url, params=params)
+                if response.status_code == 429 or response.status_code >= 500:
+                    retry_after = response.headers.get("Retry-After")
+                    error = f"HTTP {response.status_code}"
+                else:
+                    response.raise_for_status()
+                    data = response.json()
+                    if isinstance(data, dict) and data.get("error", {}).get("code") == QUOTA_EXCEEDED:
+                        self.bucket.drain()
+                        error = "quota exceeded"
+                    else:
+                        return data
+            except httpx.TransportError as e:
+                error = repr(e)
+
+            if attempt == self.retries:
+                raise Exception(f"Deezer request failed after {attempt + 1} attempts: {url} ({error})")
+            self.retried += 1
+            delay = float(retry_after) if retry_after else min(30.0, 0.5 * 2 ** attempt)
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+    async def paginate(self, url: str, params: dict = None, max_pages: int = DEEZER_MAX_PAGES):
+        """Collect `data` from every page, following Deezer's absolute `next` links."""
+        items = []
+        for _ in range(max_pages):
+            page = await self.get_json(url, params)
+            items.extend(page.get("data", []))
+            url, params = page.get("next"), None
+            if not url:
+                break
+        return items
+
+    async def search_artist_tracks(self, artist_name: str, max_pages: int = DEEZER_MAX_PAGES):
+        return await self.paginate("/search", {"q": f'artist:"{artist_name}"'}, max_pages)
+
+
+async def fetch_tracks_for_artists(artists, client: DeezerClient, max_pages: int = DEEZER_MAX_PAGES):
+    """Fetch tracks for (artist_id, name) pairs with bounded concurrency.
+
+    Returns {artist_id: [track, ...]}; artists whose fetch failed are reported and skipped.
+    """
+    semaphore = asyncio.Semaphore(client.concurrency)
+
+    async def fetch(artist_id, name):
+        async with semaphore:
+            try:
+                return artist_id, await client.search_artist_tracks(name, max_pages)
+            except Exception as e:
+                print(f"Error for {name}: {e}")
+                return artist_id, None
+
+    results = await asyncio.gather(*(fetch(artist_id, name) for artist_id, name in artists))
+    return {artist_id: tracks for artist_id, tracks in results if tracks is not None}
+
+
+def run_sync(coro):
+    """asyncio.run that also works when called from a running loop (e.g. a notebook)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
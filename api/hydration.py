@@ -0,0 +1,210 @@
+import asyncio
+import os
+import threading
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from db_models import Track, user_likes
+from schemas import SongOut
+from cache import track_cache
+from metrics import timed
+
+
+SONG_COLUMNS = [getattr(Track, field) for field in SongOut.__fields__]
+LIKED_PAGE_SIZE = 500
+MAX_LIKED_PAGE = 1000
+HYDRATE_MAX_INFLIGHT = int(os.environ.get("HYDRATE_MAX_INFLIGHT", "4"))
+HYDRATE_MAX_BATCH = int(os.environ.get("HYDRATE_MAX_BATCH", "2000"))
+
+
+def liked_songs_query(username: str, cursor: int = None, limit: int = None):
+    """SongOut columns of a user's likes in song_id order, starting after `cursor`.
+
+    Keyset pagination over the (username, song_id) primary key of user_likes, so every
+    page costs the same no matter how deep it is.
+    """
+    stmt = (
+        select(*SONG_COLUMNS)
+        .join(user_likes, user_likes.c.song_id == Track.id)
+        .where(user_likes.c.username == username)
+    )
+    if cursor is not None:
+        stmt = stmt.where(user_likes.c.song_id > cursor)
+    stmt = stmt.order_by(user_likes.c.song_id)
+    return stmt.limit(limit) if limit else stmt
+
+
+def liked_page_queries(username: str, cursor: int = None, limit: int = None):
+    """Keyset page loop shared by the sync and async /liked streams.
+
+    Yields the query for each page and expects that page's rows back through send();
+    stops after a short page or once `limit` rows have been sent.
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page_size = LIKED_PAGE_SIZE if remaining is None else min(LIKED_PAGE_SIZE, remaining)
+        rows = yield liked_songs_query(username, cursor, page_size)
+        if len(rows) < page_size:
+            return
+        cursor = rows[-1]["id"]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+def iter_liked_pages(db: Session, username: str, cursor: int = None, limit: int = None):
+    """Yield lists of liked-song dicts page by page, up to `limit` rows in total."""
+    pages = liked_page_queries(username, cursor, limit)
+    rows = None
+    while True:
+        try:
+            stmt = pages.send(rows)
+        except StopIteration:
+            return
+        rows = [row._asdict() for row in db.execute(stmt)]
+        if rows:
+            yield rows
+
+
+async def iter_liked_pages_async(db, username: str, cursor: int = None, limit: int = None):
+    """iter_liked_pages for an AsyncSession."""
+    pages = liked_page_queries(username, cursor, limit)
+    rows = None
+    while True:
+        try:
+            stmt = pages.send(rows)
+        except StopIteration:
+            return
+        rows = [row._asdict() for row in await db.execute(stmt)]
+        if rows:
+            yield rows
+
+
+def _ordered(songs: dict, track_ids):
+    # Score order from the caller; ids deleted since they were ranked simply drop out.
+    return [songs[t] for t in track_ids if t in songs]
+
+
+def _songs_query(track_ids):
+    return select(*SONG_COLUMNS).where(Track.id.in_(track_ids))
+
+
+class _Batch:
+    def __init__(self):
+        self.ids = set()
+        self.songs = {}
+        self.error = None
+
+
+class HydrationBatcher:
+    """Coalesces track lookups from concurrent requests into shared IN queries.
+
+    At most `max_inflight` lookups run at once. Requests that miss the cache while they
+    are busy join one pending batch, whose first member runs the query for all of them
+    once a slot frees up, so an idle server adds no latency and a loaded one issues
+    fewer, larger queries.
+    """
+
+    def __init__(self, max_inflight: int = HYDRATE_MAX_INFLIGHT, max_ids: int = HYDRATE_MAX_BATCH):
+        self.max_inflight = max_inflight
+        self.max_ids = max_ids
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._pending = None
+        # asyncio primitives are bound to the loop, so they are created on first use.
+        self._async_slots = None
+        self._async_pending = None
+        self.queries = 0
+        self.requests = 0
+
+    def _join(self, pending, ids, new_batch):
+        joined = pending is not None and len(pending[0].ids) < self.max_ids
+        batch = pending if joined else new_batch()
+        batch[0].ids.update(ids)
+        self.requests += 1
+        return batch, not joined
+
+    def _collect(self, batch: _Batch, ids):
+        if batch.error:
+            raise batch.error
+        return {t: batch.songs[t] for t in ids if t in batch.songs}
+
+    def _finish(self, batch: _Batch, rows, generation):
+        batch.songs = {row.id: row._asdict() for row in rows}
+        # Rows read before a catalogue invalidation are served but not cached.
+        track_cache.set_many(batch.songs, generation=generation)
+        self.queries += 1
+
+    def fetch(self, db: Session, track_ids) -> dict:
+        with self._lock:
+            (batch, done), leader = self._join(
+                self._pending, track_ids, lambda: (_Batch(), threading.Event())
+            )
+            if leader:
+                self._pending = (batch, done)
+        if not leader:
+            done.wait()
+            return self._collect(batch, track_ids)
+        with self._slots:
+            with self._lock:
+                if self._pending is not None and self._pending[0] is batch:
+                    self._pending = None
+            try:
+                generation = track_cache.generation()
+                self._finish(batch, db.execute(_songs_query(list(batch.ids))).all(), generation)
+            except Exception as e:
+                batch.error = e
+            finally:
+                done.set()
+        return self._collect(batch, track_ids)
+
+    async def fetch_async(self, db, track_ids) -> dict:
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_inflight)
+        (batch, done), leader = self._join(
+            self._async_pending, track_ids, lambda: (_Batch(), asyncio.Event())
+        )
+        if leader:
+            self._async_pending = (batch, done)
+        if not leader:
+            await done.wait()
+            return self._collect(batch, track_ids)
+        async with self._async_slots:
+            if self._async_pending is not None and self._async_pending[0] is batch:
+                self._async_pending = None
+            try:
+                generation = track_cache.generation()
+                result = await db.execute(_songs_query(list(batch.ids)))
+                self._finish(batch, result.all(), generation)
+            except Exception as e:
+                batch.error = e
+            finally:
+                done.set()
+        return self._collect(batch, track_ids)
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "queries": self.queries}
+
+
+hydration_batcher = HydrationBatcher()
+
+
+def hydrate_songs(db: Session, track_ids):
+    """SongOut payloads for `track_ids` in the given order, served from the track cache.
+
+    Misses are read as SongOut columns only, never as ORM entities.
+    """
+    with timed("hydrate"):
+        songs = track_cache.get_many(track_ids)
+        missing = [t for t in track_ids if t not in songs]
+        if missing:
+            songs.update(hydration_batcher.fetch(db, missing))
+        return _ordered(songs, track_ids)
+
+
+async def hydrate_songs_async(db, track_ids):
+    """hydrate_songs for an AsyncSession."""
+    with timed("hydrate"):
+        songs = track_cache.get_many(track_ids)
+        missing = [t for t in track_ids if t not in songs]
+        if missing:
+            songs.update(await hydration_batcher.fetch_async(db, missing))
+        return _ordered(songs, track_ids)
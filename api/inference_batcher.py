@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from collections import Counter, deque
+import numpy as np
+
+ML_BATCH_SIZE = int(os.environ.get("ML_BATCH_SIZE", "32"))
+ML_BATCH_WAIT_MS = float(os.environ.get("ML_BATCH_WAIT_MS", "5"))
+ML_QUEUE_DEPTH = int(os.environ.get("ML_QUEUE_DEPTH", "1024"))
+
+
+class InferenceBatcher:
+    """Coalesces concurrent RecVAE requests into one forward pass.
+
+    Requests wait at most `max_wait_ms` (or until `max_batch` users are queued); their
+    like vectors are stacked, scored in a single call and the top-k lists fanned back out.
+    """
+
+    def __init__(self, scorer, max_batch: int = ML_BATCH_SIZE,
+                 max_wait_ms: float = ML_BATCH_WAIT_MS, max_queue: int = ML_QUEUE_DEPTH):
+        self.scorer = scorer
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.loop = None
+        self._queue = None
+        self._task = None
+
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.forward_seconds = 0.0
+        self._recent = deque()  # (finished_at, batch size) over the last minute
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = self.loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def submit(self, liked_song_ids, k: int):
+        future = self.loop.create_future()
+        try:
+            self._queue.put_nowait((liked_song_ids, k, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        return await future
+
+    def submit_threadsafe(self, liked_song_ids, k: int, timeout: float = None):
+        """Entry point for sync handlers running in the threadpool."""
+        return asyncio.run_coroutine_threadsafe(
+            self.submit(liked_song_ids, k), self.loop
+        ).result(timeout)
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = self.loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            try:
+                state = self.scorer._state
+                x = np.stack([self.scorer.like_vector(state, liked) for liked, _, _, _ in batch])
+                # The matmuls release the GIL; keep them off the event loop thread.
+                scores = await self.loop.run_in_executor(None, self.scorer.score, state, x)
+                results = [
+                    self.scorer.top_k(state, x[i], scores[i], k) if x[i].any() else []
+                    for i, (_, k, _, _) in enumerate(batch)
+                ]
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            for (_, _, future, enqueued), result in zip(batch, results):
+                self.wait_seconds += started - enqueued
+                if not future.done():
+                    future.set_result(result)
+            self.forward_seconds += finished - started
+            self.batch_sizes[len(batch)] += 1
+            self.requests += len(batch)
+            self._recent.append((finished, len(batch)))
+            self._trim_recent(finished)
+
+    def _trim_recent(self, now: float):
+        # Trimmed on every batch, not only when /stats is polled, so it stays bounded.
+        while self._recent and now - self._recent[0][0] > 60:
+            self._recent.popleft()
+
+    def stats(self) -> dict:
+        self._trim_recent(time.perf_counter())
+        batches = sum(self.batch_sizes.values())
+        return {
+            "requests": self.requests,
+            "batches": batches,
+            "rejected": self.rejected,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "avg_batch_size": self.requests / batches if batches else 0.0,
+            "avg_wait_ms": 1000 * self.wait_seconds / self.requests if self.requests else 0.0,
+            "avg_forward_ms": 1000 * self.forward_seconds / batches if batches else 0.0,
+            "throughput_rps": sum(n for _, n in self._recent) / 60,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+        }
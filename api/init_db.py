@@ -1,5 +1,21 @@
+from sqlalchemy import inspect, text
 from db_models import Base
 from db_config import engine
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    add_liked_at()
+
+def add_liked_at():
+    # create_all does not alter existing tables; add the column older databases lack.
+    columns = {c["name"] for c in inspect(engine).get_columns("user_likes")}
+    if "liked_at" in columns:
+        return
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE user_likes ADD COLUMN liked_at TIMESTAMPTZ DEFAULT now()"))
+        else:
+            # SQLite cannot add a column with a non-constant default.
+            conn.execute(text("ALTER TABLE user_likes ADD COLUMN liked_at TIMESTAMP"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_user_likes_liked_at ON user_likes (liked_at)"))
+    print("Added user_likes.liked_at.")
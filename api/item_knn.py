@@ -0,0 +1,226 @@
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import scipy.sparse as sp
+
+# Next to the model artifacts by default, not in the process working directory.
+ITEM_KNN_PATH = os.environ.get("ITEM_KNN_PATH") or os.path.join(os.environ.get("MODEL_DIR", "model"), "item_knn")
+ITEM_KNN_K = int(os.environ.get("ITEM_KNN_K", "50"))
+# Rebuilt from the like graph once it is this old or this many likes have changed.
+ITEM_KNN_REFRESH_SECONDS = float(os.environ.get("ITEM_KNN_REFRESH_SECONDS", "3600"))
+ITEM_KNN_REBUILD_LIKES = int(os.environ.get("ITEM_KNN_REBUILD_LIKES", "10000"))
+
+
+def build_item_neighbours(user_indptr, user_items, n_items: int, k: int = ITEM_KNN_K,
+                          metric: str = "cosine", batch_size: int = 2048):
+    """Top-k co-like neighbours for every track.
+
+    Computes X^T X one block of tracks at a time with sparse matmul, so memory is bounded
+    by the co-like pairs of a single block. Returns (neighbours, scores) of shape
+    (n_items, k); missing neighbours are padded with -1 / 0.
+    """
+    n_users = len(user_indptr) - 1
+    X = sp.csr_matrix(
+        (np.ones(len(user_items), dtype=np.float32), user_items, user_indptr),
+        shape=(n_users, n_items),
+    )
+    XT = X.T.tocsr()
+    degree = np.diff(XT.indptr).astype(np.float32)
+
+    neighbours = np.full((n_items, k), -1, dtype=np.int32)
+    scores = np.zeros((n_items, k), dtype=np.float32)
+
+    for start in range(0, n_items, batch_size):
+        stop = min(start + batch_size, n_items)
+        co = (XT[start:stop] @ X).tocsr()
+        co.sum_duplicates()
+
+        rows = np.repeat(np.arange(start, stop), np.diff(co.indptr))
+        cols = co.indices
+        shared = co.data
+        if metric == "jaccard":
+            sim = shared / (degree[rows] + degree[cols] - shared)
+        else:
+            sim = shared / np.sqrt(degree[rows] * degree[cols])
+
+        keep = rows != cols
+        rows, cols, sim = rows[keep], cols[keep], sim[keep]
+
+        # Sort by row, then by descending similarity, and keep the first k of every row.
+        order = np.lexsort((-sim, rows))
+        rows, cols, sim = rows[order], cols[order], sim[order]
+        row_start = np.searchsorted(rows, rows, side="left")
+        rank = np.arange(len(rows)) - row_start
+        top = rank < k
+        neighbours[rows[top], rank[top]] = cols[top]
+        scores[rows[top], rank[top]] = sim[top]
+
+    return neighbours, scores
+
+
+def save_index(path: str, song_ids, neighbours, scores):
+    """Write the index to a fresh directory and swap it in for `path`.
+
+    Readers never see files from two builds; processes still mapping the old files keep
+    them until they reload.
+    """
+    tmp = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    order = np.argsort(song_ids, kind="stable")
+    # Store rows sorted by song id so lookups can use searchsorted instead of a dict;
+    # neighbour columns are remapped to the same order.
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    sorted_neighbours = np.where(neighbours[order] >= 0, remap[neighbours[order]], -1)
+    arrays = {
+        "song_ids": np.asarray(song_ids, dtype=np.int64)[order],
+        "neighbours": sorted_neighbours.astype(np.int32),
+        "scores": scores[order],
+    }
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), values)
+    old = f"{path}.old{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+class ItemKNNIndex:
+    """Memory-mapped top-k neighbour lists; serving cost scales with the user's like count."""
+
+    def __init__(self, song_ids, neighbours, scores):
+        self.song_ids = song_ids
+        self.neighbours = neighbours
+        self.scores = scores
+
+    @classmethod
+    def load(cls, path: str):
+        return cls(*(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                     for name in ("song_ids", "neighbours", "scores")))
+
+    def _rows(self, song_ids):
+        song_ids = np.fromiter(song_ids, dtype=np.int64)
+        if not len(self.song_ids):
+            return song_ids[:0]
+        rows = np.minimum(np.searchsorted(self.song_ids, song_ids), len(self.song_ids) - 1)
+        return rows[self.song_ids[rows] == song_ids]
+
+    def recommend(self, liked_song_ids, top_n: int):
+        rows = self._rows(liked_song_ids)
+        if not len(rows):
+            return []
+        candidates = np.asarray(self.neighbours[rows]).ravel()
+        weights = np.asarray(self.scores[rows]).ravel()
+        valid = candidates >= 0
+        candidates, weights = candidates[valid], weights[valid]
+
+        unique, inverse = np.unique(candidates, return_inverse=True)
+        totals = np.bincount(inverse, weights=weights)
+        not_liked = ~np.isin(unique, rows)
+        unique, totals = unique[not_liked], totals[not_liked]
+
+        top_n = min(top_n, len(unique))
+        if top_n <= 0:
+            return []
+        top = np.argpartition(-totals, top_n - 1)[:top_n]
+        top = top[np.argsort(-totals[top], kind="stable")]
+        return [(int(self.song_ids[i]), float(t)) for i, t in zip(unique[top], totals[top])]
+
+
+class ItemKNNService:
+    """Holds the current index and rebuilds it from the like graph in the background.
+
+    The index goes stale after ITEM_KNN_REFRESH_SECONDS or ITEM_KNN_REBUILD_LIKES like
+    changes, like SearchIndex. With `shared`, another process (the shared_state
+    publisher) owns rebuilds and this one only reloads newer files.
+    """
+
+    def __init__(self, path: str = ITEM_KNN_PATH, refresh_seconds: float = ITEM_KNN_REFRESH_SECONDS,
+                 rebuild_likes: int = ITEM_KNN_REBUILD_LIKES):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_likes = rebuild_likes
+        self.index = None
+        self.built_at = 0.0  # wall clock, from the files, so it survives restarts
+        self.changes = 0
+        self.shared = False
+        self._building = threading.Lock()
+
+    def _mtime(self) -> float:
+        try:
+            return os.path.getmtime(os.path.join(self.path, "scores.npy"))
+        except OSError:
+            return 0.0
+
+    def load(self) -> bool:
+        built_at = self._mtime()
+        if not built_at:
+            return False
+        try:
+            self.index = ItemKNNIndex.load(self.path)
+        except FileNotFoundError:
+            # Caught between the two renames of a swap; the next reload picks it up.
+            return False
+        self.built_at = built_at
+        return True
+
+    def reload_if_newer(self) -> bool:
+        built_at = self._mtime()
+        return built_at > self.built_at and self.load()
+
+    def record_changes(self, n: int = 1):
+        self.changes += n
+
+    def stale(self) -> bool:
+        if self.shared or self._building.locked():
+            return False
+        return (self.index is None or self.changes >= self.rebuild_likes
+                or time.time() - self.built_at > self.refresh_seconds)
+
+    def rebuild(self, graph, k: int = ITEM_KNN_K, metric: str = "cosine"):
+        if not self._building.acquire(blocking=False):
+            return
+        try:
+            # Likes arriving during the build are counted towards the next one.
+            self.changes = 0
+            _, song_ids, indptr, items = graph.to_csr()
+            neighbours, scores = build_item_neighbours(indptr, items, len(song_ids), k, metric)
+            save_index(self.path, song_ids, neighbours, scores)
+            self.load()
+            print(f"Item-kNN index rebuilt for {len(song_ids)} tracks (k={k}, {metric}).")
+        finally:
+            self._building.release()
+
+    def rebuild_in_background(self, graph):
+        threading.Thread(target=self.rebuild, args=(graph,), daemon=True).start()
+
+    def recommend(self, liked_song_ids, top_n: int):
+        if self.index is None:
+            return None
+        return self.index.recommend(liked_song_ids, top_n)
+
+
+item_knn = ItemKNNService()
+
+
+if __name__ == "__main__":
+    import argparse
+    from db_config import SessionLocal
+    from recommendation_state import like_graph
+
+    parser = argparse.ArgumentParser(description="Build the item-kNN neighbour index offline.")
+    parser.add_argument("--k", type=int, default=ITEM_KNN_K)
+    parser.add_argument("--metric", choices=["cosine", "jaccard"], default="cosine")
+    parser.add_argument("--path", default=ITEM_KNN_PATH)
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        like_graph.load(session)
+    finally:
+        session.close()
+    ItemKNNService(args.path).rebuild(like_graph, args.k, args.metric)
@@ -0,0 +1,153 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _labels(names, values) -> str:
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in values)
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, escaped))
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label tuple."""
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for label_values, series in items:
+            base = _labels(self.labels, label_values)
+            sep = "," if base else ""
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-2]}'
+            yield f"{self.name}_count{{{base}}} {series[-2]}"
+            yield f"{self.name}_sum{{{base}}} {series[-1]}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{{{_labels(self.labels, label_values)}}} {value}"
+
+
+http_requests = Counter("http_requests_total", "HTTP requests.", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route"))
+db_queries = Histogram("http_request_db_queries", "SQL statements per request.", ("route",), COUNT_BUCKETS)
+db_time = Histogram("http_request_db_seconds", "Time in SQL statements per request.", ("route",))
+phase_time = Histogram("app_phase_seconds", "Time in instrumented phases (ml_remote, hydrate, serialize, ...).",
+                       ("phase",))
+REGISTRY = [http_requests, http_latency, db_queries, db_time, phase_time]
+
+# Mutable per-request totals. Sync endpoints run in a threadpool with a copy of the
+# context, so they share this dict with the middleware.
+_request = contextvars.ContextVar("request_metrics", default=None)
+
+
+@contextmanager
+def timed(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_time.observe(time.perf_counter() - started, phase)
+
+
+# The start time lives on the statement's execution context, not the pooled connection:
+# a statement that raises never reaches after_cursor_execute, and a stack on conn.info
+# would pair every later query on that connection with the wrong start.
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    totals = _request.get()
+    if totals is not None:
+        totals["queries"] += 1
+        totals["db_seconds"] += elapsed
+    phase_time.observe(elapsed, "db")
+
+
+async def middleware(request, call_next):
+    """Per-route latency plus the SQL count/time spent while serving the request."""
+    totals = {"queries": 0, "db_seconds": 0.0}
+    token = _request.set(totals)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        _request.reset(token)
+        route = request.scope.get("route")
+        # Templates ("/liked/{username}") keep label cardinality bounded.
+        path = getattr(route, "path", "unmatched")
+        http_latency.observe(time.perf_counter() - started, request.method, path)
+        http_requests.inc(request.method, path, status)
+        db_queries.observe(totals["queries"], path)
+        db_time.observe(totals["db_seconds"], path)
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that records JSON encoding time as the "serialize" phase."""
+
+    def render(self, content) -> bytes:
+        with timed("serialize"):
+            return super().render(content)
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
@@ -0,0 +1,178 @@
+import os
+import httpx
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from db_models import user_recommendations
+from recommendation_state import like_graph
+from metrics import timed
+import shared_state
+
+ML_INFERENCE = os.environ.get("ML_INFERENCE", "remote")
+API_URL = os.environ.get("API_URL", "")
+ML_API_TIMEOUT = float(os.environ.get("ML_API_TIMEOUT", "2.0"))
+ML_BATCHING = os.environ.get("ML_BATCHING", "0") == "1"
+ML_ANN = os.environ.get("ML_ANN", "0") == "1"
+ML_MATERIALIZED = os.environ.get("ML_MATERIALIZED", "1") == "1"
+
+ml_batcher = None
+if ML_INFERENCE == "local":
+    from recvae_inference import recvae_scorer
+    from recvae_ann import recvae_ann
+    if ML_BATCHING:
+        from inference_batcher import InferenceBatcher
+        ml_batcher = InferenceBatcher(recvae_scorer)
+else:
+    _limits = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+    ml_client = httpx.Client(timeout=ML_API_TIMEOUT, limits=_limits)
+    ml_async_client = httpx.AsyncClient(timeout=ML_API_TIMEOUT, limits=_limits)
+
+
+def load():
+    if ML_INFERENCE == "local":
+        recvae_scorer.load(trusted=shared_state.trusted_model())
+        if ML_ANN:
+            _load_ann(recvae_scorer.path)
+        recvae_scorer.watch(on_swap=_load_ann if ML_ANN else None)
+
+
+def _load_ann(model_path: str):
+    # A versioned model only uses the index exported into its own directory, so the
+    # index follows it across hot-swaps; legacy models use ANN_DIR.
+    loaded = False
+    if recvae_scorer.version:
+        recvae_ann.clear()
+        loaded = recvae_ann.load(os.path.join(model_path, "ann"))
+    else:
+        loaded = recvae_ann.load()
+    if not loaded:
+        print("ML_ANN is set but no ANN index was found; using exact scoring.")
+
+
+async def start():
+    if ml_batcher:
+        await ml_batcher.start()
+
+
+async def stop():
+    if ml_batcher:
+        await ml_batcher.stop()
+    if ML_INFERENCE != "local":
+        await ml_async_client.aclose()
+
+
+def _remote_url(username: str, top_k: int) -> str:
+    return f"{API_URL}/recommend/{username}?top_k={top_k}"
+
+
+def _with_popular(liked, track_ids, top_k: int):
+    # Cold start: users with no likes the model was trained on (new sign-ups, or only
+    # tracks ingested since the last run) get the most-liked tracks instead.
+    if len(track_ids) >= top_k:
+        return track_ids
+    seen = set(liked).union(track_ids)
+    return list(track_ids) + like_graph.popular(top_k - len(track_ids), exclude=seen)
+
+
+_materialized = {"hits": 0, "misses": 0}
+
+
+def _materialized_query(username: str):
+    return select(user_recommendations.c.track_ids, user_recommendations.c.model_version).where(
+        user_recommendations.c.username == username
+    )
+
+
+def _current_model_version():
+    # Only known when the model is embedded; the remote service's version is not visible.
+    if ML_INFERENCE != "local":
+        return None
+    return recvae_scorer.version or "legacy"
+
+
+def _from_materialized(row, username: str, top_k: int, n: int):
+    # Rows shorter than top_k fall through to live scoring; liked tracks are dropped in
+    # case a like landed while the table was being reloaded. Rows from another model
+    # (after a fine-tune or hot-swap, which do not rematerialize) are misses too.
+    current = _current_model_version()
+    if row is not None and (current is None or row[1] == current):
+        liked = like_graph.liked(username)
+        track_ids = [t for t in row[0] if t not in liked]
+        if len(track_ids) >= top_k:
+            _materialized["hits"] += 1
+            return track_ids[:n]
+    _materialized["misses"] += 1
+    return None
+
+
+def recommend_track_ids(username: str, top_k: int, db=None, candidates: int = 0):
+    """RecVAE top-k track ids, from the embedded model or the remote service.
+
+    With a session, the nightly user_recommendations row is tried first: one primary-key
+    read. The embedded model folds the user's current likes into the encoder on every
+    call, so it covers users and likes newer than the last training run. `candidates`
+    asks for a longer list for re-ranking.
+    """
+    n = max(top_k, candidates)
+    if db is not None and ML_MATERIALIZED:
+        with timed("ml_materialized"):
+            row = db.execute(_materialized_query(username)).first()
+            track_ids = _from_materialized(row, username, top_k, n)
+        if track_ids is not None:
+            return track_ids
+    liked = like_graph.liked(username)
+    if ML_INFERENCE == "local":
+        with timed("ml_local"):
+            if recvae_ann.ready:
+                track_ids = recvae_ann.recommend(liked, n)
+            elif ml_batcher:
+                track_ids = ml_batcher.submit_threadsafe(liked, n, ML_API_TIMEOUT)
+            else:
+                track_ids = recvae_scorer.recommend(liked, n)
+    else:
+        try:
+            with timed("ml_remote"):
+                response = ml_client.get(_remote_url(username, n))
+            response.raise_for_status()
+            track_ids = response.json().get("recommended_track_ids", [])
+        except httpx.HTTPError as e:
+            print(f"Remote recommendation failed for {username}: {e}")
+            track_ids = []
+    return _with_popular(liked, track_ids, n)
+
+
+async def recommend_track_ids_async(username: str, top_k: int, db=None, candidates: int = 0):
+    n = max(top_k, candidates)
+    if db is not None and ML_MATERIALIZED:
+        with timed("ml_materialized"):
+            result = await db.execute(_materialized_query(username))
+            track_ids = _from_materialized(result.first(), username, top_k, n)
+        if track_ids is not None:
+            return track_ids
+    liked = like_graph.liked(username)
+    if ML_INFERENCE == "local":
+        with timed("ml_local"):
+            if recvae_ann.ready:
+                track_ids = await run_in_threadpool(recvae_ann.recommend, liked, n)
+            elif ml_batcher:
+                track_ids = await ml_batcher.submit(liked, n)
+            else:
+                track_ids = await run_in_threadpool(recvae_scorer.recommend, liked, n)
+    else:
+        try:
+            with timed("ml_remote"):
+                response = await ml_async_client.get(_remote_url(username, n))
+            response.raise_for_status()
+            track_ids = response.json().get("recommended_track_ids", [])
+        except httpx.HTTPError as e:
+            print(f"Remote recommendation failed for {username}: {e}")
+            track_ids = []
+    return _with_popular(liked, track_ids, n)
+
+
+def stats() -> dict:
+    model = {"model_version": recvae_scorer.version} if ML_INFERENCE == "local" else {}
+    if ML_MATERIALIZED:
+        model["materialized"] = dict(_materialized)
+    if not ml_batcher:
+        return {"batching": False, **model}
+    return {"batching": True, **model, **ml_batcher.stats()}
@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILER_TOKEN = os.environ.get("PROFILER_TOKEN", "")
+PROFILER_MAX_SECONDS = float(os.environ.get("PROFILER_MAX_SECONDS", "300"))
+
+
+class SamplingProfiler:
+    """Wall-clock sampler over every thread's stack, switchable at runtime.
+
+    Samples sys._current_frames() from a daemon thread, so the served code is not
+    instrumented and the overhead is one stack walk per interval. Output is in collapsed
+    "frame;frame;frame count" form, ready for flamegraph.pl or speedscope.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval = 0.0
+        self.started_at = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: float = 5, max_seconds: float = PROFILER_MAX_SECONDS) -> bool:
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.interval = interval_ms / 1000
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(max_seconds,), daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self, max_seconds: float):
+        own = threading.get_ident()
+        deadline = time.monotonic() + max_seconds
+        # Stops itself so a forgotten session cannot keep sampling forever.
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "started_at": self.started_at,
+            "distinct_stacks": len(self.stacks),
+        }
+
+
+profiler = SamplingProfiler()
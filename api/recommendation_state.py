@@ -0,0 +1,380 @@
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from db_models import user_likes
+from item_knn import item_knn
+from shared_state import SHARED_STATE_DIR
+
+OVERLAP_CACHE_SIZE = int(os.environ.get("OVERLAP_CACHE_SIZE", "10000"))
+
+
+def _csr(rows: np.ndarray, cols: np.ndarray, n_rows: int):
+    """Group `cols` by `rows` into (indptr, indices) arrays."""
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order]
+
+
+def _gather(indptr, indices, rows: np.ndarray):
+    """Concatenated CSR rows `rows`, plus the position in `rows` each value came from."""
+    starts = np.asarray(indptr[rows])
+    lengths = np.asarray(indptr[rows + 1]) - starts
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    first = np.cumsum(lengths) - lengths
+    positions = np.arange(int(lengths.sum())) + np.repeat(starts - first, lengths)
+    return np.asarray(indices[positions]), owner
+
+
+class LikeGraph:
+    """In-process co-occurrence engine over the user_likes table.
+
+    Loaded once from the database, then kept current by the add/remove deltas published
+    from the like endpoints, so reads never trigger a rebuild. Every delta costs
+    O(degree of the touched track).
+    """
+
+    def __init__(self, overlap_cache_size: int = OVERLAP_CACHE_SIZE):
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.user_items = defaultdict(set)   # username -> liked song ids
+        self.item_users = defaultdict(set)   # song id -> usernames (inverted index)
+        self.popularity = Counter()          # song id -> number of likes
+        # LRU of username -> Counter(other username -> number of shared likes). Filled on
+        # a user's first read and maintained by deltas while cached; each entry is as
+        # large as the user's co-likers, so only the most recent readers are kept.
+        self.overlap = OrderedDict()
+        self.overlap_cache_size = overlap_cache_size
+
+    def load(self, db: Session):
+        rows = db.execute(select(user_likes.c.username, user_likes.c.song_id)).all()
+        with self._lock:
+            self.user_items.clear()
+            self.item_users.clear()
+            self.popularity.clear()
+            self.overlap.clear()
+            for username, song_id in rows:
+                self.user_items[username].add(song_id)
+                self.item_users[song_id].add(username)
+            self.popularity.update({s: len(u) for s, u in self.item_users.items()})
+            self.loaded = True
+
+    def ensure_loaded(self, db: Session):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load(db)
+
+    def add_like(self, username: str, song_id: int):
+        with self._lock:
+            if not self.loaded:
+                return
+            liked = self.user_items[username]
+            if song_id in liked:
+                return
+            own = self.overlap.get(username)
+            for other in self.item_users[song_id]:
+                if own is not None:
+                    own[other] += 1
+                if other in self.overlap:
+                    self.overlap[other][username] += 1
+            liked.add(song_id)
+            self.item_users[song_id].add(username)
+            self.popularity[song_id] += 1
+
+    def remove_like(self, username: str, song_id: int):
+        with self._lock:
+            if not self.loaded:
+                return
+            liked = self.user_items.get(username)
+            if not liked or song_id not in liked:
+                return
+            liked.discard(song_id)
+            users = self.item_users[song_id]
+            users.discard(username)
+            own = self.overlap.get(username)
+            for other in users:
+                if own is not None:
+                    self._decrement(own, other)
+                if other in self.overlap:
+                    self._decrement(self.overlap[other], username)
+            self.popularity[song_id] -= 1
+            if not users:
+                del self.item_users[song_id]
+                del self.popularity[song_id]
+            if not liked:
+                del self.user_items[username]
+
+    def remove_songs(self, song_ids):
+        with self._lock:
+            for song_id in song_ids:
+                likers = list(self.item_users.get(song_id, ()))
+                # Their overlaps would each be decremented once per co-liker; rebuilding
+                # on the next read is cheaper.
+                for username in likers:
+                    self.overlap.pop(username, None)
+                for username in likers:
+                    self.remove_like(username, song_id)
+
+    @staticmethod
+    def _decrement(counter: Counter, key):
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+
+    def _overlap_for(self, username: str) -> Counter:
+        # Walk the inverted index once; only users sharing at least one track show up.
+        own = self.overlap.get(username)
+        if own is not None:
+            self.overlap.move_to_end(username)
+            return own
+        own = Counter()
+        for song_id in self.user_items[username]:
+            own.update(self.item_users[song_id])
+        del own[username]
+        if self.overlap_cache_size > 0:
+            self.overlap[username] = own
+            while len(self.overlap) > self.overlap_cache_size:
+                self.overlap.popitem(last=False)
+        return own
+
+    def liked(self, username: str) -> set:
+        with self._lock:
+            return set(self.user_items.get(username, ()))
+
+    def popular(self, n: int, exclude=()):
+        """The n most-liked song ids outside `exclude`, for users the models know nothing about."""
+        with self._lock:
+            ranked = self.popularity.most_common(n + len(exclude))
+        return [song_id for song_id, _ in ranked if song_id not in exclude][:n]
+
+    def jaccard_scores(self, username: str) -> dict:
+        with self._lock:
+            target = self.user_items.get(username)
+            if not target:
+                return {}
+            scores = defaultdict(float)
+            for other, shared in self._overlap_for(username).items():
+                other_likes = self.user_items[other]
+                similarity = shared / (len(target) + len(other_likes) - shared)
+                for song_id in other_likes:
+                    if song_id not in target:
+                        scores[song_id] += similarity
+            return scores
+
+    def top_n(self, username: str, top_n: int):
+        scores = self.jaccard_scores(username)
+        return sorted(scores.items(), key=lambda x: -x[1])[:top_n]
+
+    def recommend(self, username: str, top_n: int, db: Session):
+        self.ensure_loaded(db)
+        return self.top_n(username, top_n)
+
+    def to_csr(self):
+        """Export the like graph as (usernames, song_ids, user_indptr, user_items) arrays."""
+        with self._lock:
+            usernames = list(self.user_items)
+            song_ids = np.fromiter(self.item_users, dtype=np.int64, count=len(self.item_users))
+            item_index = {s: i for i, s in enumerate(song_ids.tolist())}
+            degree = np.fromiter((len(self.user_items[u]) for u in usernames), dtype=np.int64,
+                                 count=len(usernames))
+            cols = np.fromiter((item_index[s] for u in usernames for s in self.user_items[u]),
+                               dtype=np.int64, count=int(degree.sum()))
+        rows = np.repeat(np.arange(len(usernames), dtype=np.int64), degree)
+        indptr, indices = _csr(rows, cols, len(usernames))
+        return usernames, song_ids, indptr, indices
+
+
+class SharedLikeGraph:
+    """LikeGraph's read API over flat CSR arrays that many processes can map at once.
+
+    The arrays are either attached from a snapshot published by shared_state.py or built
+    in-process by load(). Likes written through this process go to a small overlay that
+    applies to the writer's own likes until a snapshot read after the write replaces it;
+    other users' rows, popularity and to_csr() follow the snapshot.
+    """
+
+    ARRAYS = ("usernames", "user_indptr", "user_items", "song_ids", "item_indptr", "item_users", "popular")
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._arrays = None
+        self.path = None
+        self.read_at = 0.0
+        self._overlay = {}   # username -> {song id: (liked, written_at)}
+        self._deleted = {}   # song id -> deleted_at
+
+    @property
+    def loaded(self) -> bool:
+        return self._arrays is not None
+
+    @staticmethod
+    def build(db: Session) -> dict:
+        """The user_likes table as sorted usernames / song ids with CSR rows both ways."""
+        rows = db.execute(select(user_likes.c.username, user_likes.c.song_id)).all()
+        codes = {}
+        user_rows = np.fromiter((codes.setdefault(r[0], len(codes)) for r in rows), dtype=np.int64,
+                                count=len(rows))
+        songs = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        usernames = np.array(list(codes), dtype=str)
+        order = np.argsort(usernames, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        user_rows = rank[user_rows] if len(rows) else user_rows
+        song_ids, item_rows = np.unique(songs, return_inverse=True)
+        user_indptr, user_items = _csr(user_rows, songs, len(usernames))
+        item_indptr, item_users = _csr(item_rows.ravel(), user_rows, len(song_ids))
+        return {
+            "usernames": usernames[order],
+            "user_indptr": user_indptr,
+            "user_items": user_items,
+            "song_ids": song_ids,
+            "item_indptr": item_indptr,
+            "item_users": item_users,
+            "popular": song_ids[np.argsort(-np.diff(item_indptr), kind="stable")],
+        }
+
+    def _set(self, arrays: dict, read_at: float, path: str = None):
+        with self._lock:
+            self._arrays = arrays
+            self.read_at = read_at
+            self.path = path
+            # Writes committed before the snapshot was read are part of it now.
+            overlay = {}
+            for username, entries in self._overlay.items():
+                kept = {s: e for s, e in entries.items() if e[1] >= read_at}
+                if kept:
+                    overlay[username] = kept
+            self._overlay = overlay
+            self._deleted = {s: t for s, t in self._deleted.items() if t >= read_at}
+
+    def load(self, db: Session):
+        read_at = time.time()
+        self._set(self.build(db), read_at)
+
+    def attach(self, path: str, read_at: float):
+        self._set({name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in self.ARRAYS},
+                  read_at, path)
+
+    def ensure_loaded(self, db: Session):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load(db)
+
+    def add_like(self, username: str, song_id: int):
+        with self._lock:
+            if self.loaded:
+                self._overlay.setdefault(username, {})[song_id] = (True, time.time())
+
+    def remove_like(self, username: str, song_id: int):
+        with self._lock:
+            if self.loaded:
+                self._overlay.setdefault(username, {})[song_id] = (False, time.time())
+
+    def remove_songs(self, song_ids):
+        now = time.time()
+        with self._lock:
+            for song_id in song_ids:
+                self._deleted[song_id] = now
+
+    @staticmethod
+    def _user_row(arrays: dict, username: str) -> int:
+        usernames = arrays["usernames"]
+        row = int(np.searchsorted(usernames, username))
+        return row if row < len(usernames) and usernames[row] == username else -1
+
+    def liked(self, username: str) -> set:
+        with self._lock:
+            arrays = self._arrays
+            overlay = dict(self._overlay.get(username, {}))
+            deleted = set(self._deleted)
+        liked = set()
+        row = self._user_row(arrays, username) if arrays else -1
+        if row >= 0:
+            indptr = arrays["user_indptr"]
+            liked.update(arrays["user_items"][indptr[row]:indptr[row + 1]].tolist())
+        for song_id, (is_liked, _) in overlay.items():
+            if is_liked:
+                liked.add(song_id)
+            else:
+                liked.discard(song_id)
+        return liked - deleted
+
+    def popular(self, n: int, exclude=()):
+        """The n most-liked song ids outside `exclude`, for users the models know nothing about."""
+        with self._lock:
+            skip = set(exclude).union(self._deleted)
+        ranked = self._arrays["popular"][:n + len(skip)].tolist()
+        return [song_id for song_id in ranked if song_id not in skip][:n]
+
+    def _scores(self, username: str):
+        arrays = self._arrays
+        liked = np.fromiter(self.liked(username), dtype=np.int64)
+        song_ids = arrays["song_ids"]
+        if not len(liked) or not len(song_ids):
+            return liked[:0], np.zeros(0)
+        items = np.minimum(np.searchsorted(song_ids, liked), len(song_ids) - 1)
+        items = items[song_ids[items] == liked]
+        others, shared = np.unique(_gather(arrays["item_indptr"], arrays["item_users"], items)[0],
+                                   return_counts=True)
+        keep = others != self._user_row(arrays, username)
+        others, shared = others[keep], shared[keep]
+
+        user_indptr = arrays["user_indptr"]
+        degree = np.asarray(user_indptr[others + 1]) - np.asarray(user_indptr[others])
+        similarity = shared / (len(liked) + degree - shared)
+        candidates, owner = _gather(user_indptr, arrays["user_items"], others)
+        with self._lock:
+            deleted = np.fromiter(self._deleted, dtype=np.int64)
+        fresh = ~np.isin(candidates, liked) & ~np.isin(candidates, deleted)
+        candidates, inverse = np.unique(candidates[fresh], return_inverse=True)
+        return candidates, np.bincount(inverse.ravel(), weights=similarity[owner[fresh]],
+                                       minlength=len(candidates))
+
+    def jaccard_scores(self, username: str) -> dict:
+        candidates, scores = self._scores(username)
+        return dict(zip(candidates.tolist(), scores.tolist()))
+
+    def top_n(self, username: str, top_n: int):
+        candidates, scores = self._scores(username)
+        top_n = min(top_n, len(candidates))
+        if top_n <= 0:
+            return []
+        top = np.argpartition(-scores, top_n - 1)[:top_n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return list(zip(candidates[top].tolist(), scores[top].tolist()))
+
+    def recommend(self, username: str, top_n: int, db: Session):
+        self.ensure_loaded(db)
+        return self.top_n(username, top_n)
+
+    def to_csr(self):
+        """Export the snapshot as (usernames, song_ids, user_indptr, user_items) arrays."""
+        arrays = self._arrays
+        song_ids = np.asarray(arrays["song_ids"])
+        return (arrays["usernames"].tolist(), song_ids, np.asarray(arrays["user_indptr"]),
+                np.searchsorted(song_ids, arrays["user_items"]))
+
+
+like_graph = SharedLikeGraph() if SHARED_STATE_DIR else LikeGraph()
+
+
+def recommend_scored(username: str, top_n: int, algorithm: str = "user"):
+    """(song id, score) pairs from item-kNN when requested and built, else user-based Jaccard."""
+    ranked = None
+    if algorithm == "item":
+        if item_knn.stale():
+            item_knn.rebuild_in_background(like_graph)
+        ranked = item_knn.recommend(like_graph.liked(username), top_n)
+    if ranked is None:
+        ranked = like_graph.top_n(username, top_n)
+    return ranked
+
+
+def recommend_song_ids(username: str, top_n: int, algorithm: str = "user"):
+    return [song_id for song_id, _ in recommend_scored(username, top_n, algorithm)]
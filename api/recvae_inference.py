@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+MODEL_DIR = os.environ.get("MODEL_DIR", "model")
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS") or 0)
+MODEL_WATCH_SECONDS = float(os.environ.get("MODEL_WATCH_SECONDS", "0"))
+MODEL_VERIFY = os.environ.get("MODEL_VERIFY", "1") == "1"
+
+
+class RecVAE(nn.Module):
+    # Same layout as the network trained in recvae_model.train_model_component, so its
+    # state_dict loads as is.
+    def __init__(self, input_dim, hidden_dim=600, latent_dim=200, dropout=0.5):
+        super(RecVAE, self).__init__()
+        self.encoder = nn.Sequential(
+            nn.Linear(input_dim, hidden_dim),
+            nn.Tanh(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden_dim, hidden_dim),
+            nn.Tanh(),
+            nn.Dropout(dropout)
+        )
+        self.mu_layer = nn.Linear(hidden_dim, latent_dim)
+        self.logvar_layer = nn.Linear(hidden_dim, latent_dim)
+        self.decoder = nn.Sequential(
+            nn.Linear(latent_dim, hidden_dim),
+            nn.Tanh(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden_dim, input_dim),
+        )
+
+
+class MuScorer(nn.Module):
+    """Deterministic inference path: encoder -> mu -> decoder, no sampling of z."""
+
+    def __init__(self, model: RecVAE):
+        super(MuScorer, self).__init__()
+        self.encoder = model.encoder
+        self.mu_layer = model.mu_layer
+        self.decoder = model.decoder
+
+    def forward(self, x):
+        return self.decoder(self.mu_layer(self.encoder(x)))
+
+
+def load_scorer(model_dir: str = MODEL_DIR):
+    """Load the TorchScript export if present, otherwise the raw state_dict."""
+    with open(os.path.join(model_dir, "recvae_metadata.pkl"), "rb") as f:
+        meta = pickle.load(f)
+
+    scripted = os.path.join(model_dir, "recvae_scorer.ts")
+    if os.path.exists(scripted):
+        net = torch.jit.load(scripted, map_location="cpu")
+    else:
+        state = torch.load(os.path.join(model_dir, "recvae_model.pt"), map_location="cpu")
+        model = RecVAE(len(meta["track_ids"]))
+        model.load_state_dict(state)
+        net = MuScorer(model)
+    net.eval()
+    return net, meta
+
+
+# Versioned artifacts: <model_dir>/versions/<version>/ holds one .npy per weight under
+# weights/, the id maps as track_ids.npy / user_ids.npy, and manifest.json with a sha256
+# per file. The manifest is written last, so a version without one is still in flight.
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def new_version() -> str:
+    """Sortable UTC version name; microseconds keep back-to-back publishes apart."""
+    now = time.time()
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f".{int(now * 1e6) % 1000000:06d}Z"
+
+
+def write_artifact(model_dir: str, state_dict, track_ids, user_ids=(), version: str = None) -> str:
+    version = version or new_version()
+    final = os.path.join(model_dir, "versions", version)
+    if os.path.exists(final):
+        raise FileExistsError(f"Model version {version} already exists in {model_dir}")
+    tmp = final + ".tmp"
+    os.makedirs(os.path.join(tmp, "weights"))
+    arrays = {f"weights/{name}": t.detach().cpu().numpy() for name, t in state_dict.items()}
+    arrays["track_ids"] = np.asarray(track_ids, dtype=np.int64)
+    arrays["user_ids"] = np.asarray(user_ids, dtype=str)
+    files = {}
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+        files[f"{name}.npy"] = _sha256(os.path.join(tmp, f"{name}.npy"))
+    manifest = {"format": 1, "version": version, "tracks": len(arrays["track_ids"]), "files": files}
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(tmp, final)
+    return final
+
+
+def versions(model_dir: str = MODEL_DIR):
+    """Paths of the complete versions, newest first."""
+    root = os.path.join(model_dir, "versions")
+    if not os.path.isdir(root):
+        return []
+    names = sorted(
+        (v for v in os.listdir(root)
+         if not v.endswith(".tmp") and os.path.exists(os.path.join(root, v, "manifest.json"))),
+        reverse=True,
+    )
+    return [os.path.join(root, v) for v in names]
+
+
+def latest_version(model_dir: str = MODEL_DIR):
+    """Path of the newest complete version, or None when the directory has none."""
+    paths = versions(model_dir)
+    return paths[0] if paths else None
+
+
+def load_artifact(path: str, verify: bool = MODEL_VERIFY):
+    """Build the scorer over memory-mapped weights; returns (net, track_ids, version)."""
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if verify:
+        for name, expected in manifest["files"].items():
+            if _sha256(os.path.join(path, name)) != expected:
+                raise ValueError(f"Checksum mismatch for {name} in {path}")
+
+    # Copy-on-write maps give writable arrays for torch without reading the file; the
+    # pages are shared with the page cache and faulted in on first use.
+    state = {
+        name[len("weights/"):-len(".npy")]: torch.from_numpy(np.load(os.path.join(path, name), mmap_mode="c"))
+        for name in manifest["files"] if name.startswith("weights/")
+    }
+    track_ids = np.load(os.path.join(path, "track_ids.npy"))
+    # Build on the meta device so no throwaway weights are allocated and initialised.
+    with torch.device("meta"):
+        model = RecVAE(len(track_ids))
+    model.load_state_dict(state, assign=True)
+    net = MuScorer(model).eval()
+    return net, track_ids, manifest["version"]
+
+
+def convert_legacy(model_dir: str = MODEL_DIR) -> str:
+    """Turn recvae_model.pt + recvae_metadata.pkl into a versioned artifact."""
+    with open(os.path.join(model_dir, "recvae_metadata.pkl"), "rb") as f:
+        meta = pickle.load(f)
+    state = torch.load(os.path.join(model_dir, "recvae_model.pt"), map_location="cpu")
+    return write_artifact(model_dir, state, meta["track_ids"], meta.get("user_ids", ()))
+
+
+def export_torchscript(model_dir: str = MODEL_DIR):
+    net, meta = load_scorer(model_dir)
+    example = torch.zeros(1, len(meta["track_ids"]))
+    with torch.inference_mode():
+        traced = torch.jit.trace(net, example)
+    traced = torch.jit.freeze(traced)
+    traced.save(os.path.join(model_dir, "recvae_scorer.ts"))
+
+
+def export_onnx(model_dir: str = MODEL_DIR):
+    net, meta = load_scorer(model_dir)
+    torch.onnx.export(
+        net,
+        torch.zeros(1, len(meta["track_ids"])),
+        os.path.join(model_dir, "recvae_scorer.onnx"),
+        input_names=["likes"],
+        output_names=["scores"],
+        dynamic_axes={"likes": {0: "batch"}, "scores": {0: "batch"}},
+    )
+
+
+class RecVAEScorer:
+    """In-process RecVAE inference over the artifacts written by train_model_component."""
+
+    def __init__(self, model_dir: str = MODEL_DIR):
+        self.model_dir = model_dir
+        # (net, track_ids, (sorted track ids, their columns)), swapped as one reference so
+        # readers never see a network paired with another model's id map.
+        self._state = None
+        self.version = None
+        self.path = None
+        self._watcher = None
+        self._rejected = set()
+
+    @property
+    def ready(self) -> bool:
+        return self._state is not None
+
+    def _swap(self, net, track_ids, version, path):
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        # Sorted arrays instead of a dict: 16 bytes per track rather than ~100 in every
+        # serving process.
+        order = np.argsort(track_ids, kind="stable")
+        self._state = (net, track_ids, (track_ids[order], order))
+        self.version = version
+        self.path = path
+
+    def load(self, trusted: str = None):
+        """Load the newest version that loads, else the legacy files.
+
+        `trusted` names a version already verified by the publisher. Versions that fail
+        are skipped here and by the watcher, as in reload_if_newer.
+        """
+        if INFERENCE_THREADS:
+            torch.set_num_threads(INFERENCE_THREADS)
+        started = time.perf_counter()
+        for path in versions(self.model_dir):
+            try:
+                self._swap(*load_artifact(path, verify=MODEL_VERIFY and path != trusted), path)
+                break
+            except Exception as e:
+                print(f"Skipping model at {path}: {e}")
+                self._rejected.add(path)
+        else:
+            net, meta = load_scorer(self.model_dir)
+            self._swap(net, meta["track_ids"], None, self.model_dir)
+        elapsed = time.perf_counter() - started
+        print(f"RecVAE {self.version or 'legacy'} loaded from {self.path} "
+              f"({len(self._state[1])} tracks) in {elapsed:.2f}s.")
+
+    def reload_if_newer(self) -> bool:
+        """Swap to the newest complete version if it differs from the one being served."""
+        path = latest_version(self.model_dir)
+        if not path or path == self.path or path in self._rejected:
+            return False
+        try:
+            self._swap(*load_artifact(path), path)
+        except Exception as e:
+            print(f"Skipping model at {path}: {e}")
+            self._rejected.add(path)
+            return False
+        print(f"RecVAE hot-swapped to {self.version}.")
+        return True
+
+    def watch(self, interval: float = MODEL_WATCH_SECONDS, on_swap=None):
+        """Poll the versions directory from a daemon thread and hot-swap new models."""
+        if self._watcher or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                if self.reload_if_newer() and on_swap:
+                    on_swap(self.path)
+
+        self._watcher = threading.Thread(target=run, daemon=True)
+        self._watcher.start()
+
+    @staticmethod
+    def like_vector(state, liked_song_ids) -> np.ndarray:
+        _, track_ids, (sorted_ids, order) = state
+        x = np.zeros(len(track_ids), dtype=np.float32)
+        liked = np.fromiter(liked_song_ids, dtype=np.int64)
+        if len(liked) and len(sorted_ids):
+            pos = np.minimum(np.searchsorted(sorted_ids, liked), len(sorted_ids) - 1)
+            x[order[pos[sorted_ids[pos] == liked]]] = 1.0
+        return x
+
+    @staticmethod
+    def score(state, batch: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            return state[0](torch.from_numpy(batch)).numpy()
+
+    @staticmethod
+    def top_k(state, x: np.ndarray, scores: np.ndarray, k: int):
+        scores = np.where(x > 0, -np.inf, scores)
+        k = min(k, int(np.count_nonzero(x == 0)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return state[1][top].tolist()
+
+    def recommend(self, liked_song_ids, k: int):
+        state = self._state
+        x = self.like_vector(state, liked_song_ids)
+        if not x.any():
+            return []
+        return self.top_k(state, x, self.score(state, x[None, :])[0], k)
+
+
+recvae_scorer = RecVAEScorer()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export RecVAE artifacts for CPU serving.")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--format", choices=["torchscript", "onnx", "artifact"], default="torchscript")
+    args = parser.parse_args()
+
+    if args.format == "artifact":
+        print(convert_legacy(args.model_dir))
+    elif args.format == "onnx":
+        export_onnx(args.model_dir)
+    else:
+        export_torchscript(args.model_dir)
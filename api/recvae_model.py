@@ -5,102 +5,91 @@ import uuid
 
 @component(
     base_image="python:3.10",
-    packages_to_install=["sqlalchemy", "numpy", "psycopg2-binary"]
+    packages_to_install=["sqlalchemy", "numpy", "scipy", "psycopg2-binary"]
 )
 def extract_matrix_component(
     database_url: str,
     matrix_output: Output[Dataset],
-    metadata_output: Output[Dataset]
+    metadata_output: Output[Dataset],
+    chunk_size: int = 100000
 ):
     import numpy as np
-    import pickle
+    import scipy.sparse as sp
     import os
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker, relationship, declarative_base
-    from sqlalchemy import Column, Integer, String, ForeignKey, Table, Boolean, BigInteger
-
-    Base = declarative_base()
-
-    user_likes = Table(
-        'user_likes', Base.metadata,
-        Column('username', String, ForeignKey('users.username'), primary_key=True),
-        Column('song_id', Integer, ForeignKey('tracks.id'), primary_key=True)
-    )
-
-    class User(Base):
-        __tablename__ = 'users'
-        id = Column(Integer, primary_key=True, autoincrement=True)
-        username = Column(String, unique=True, nullable=False)
-        liked_songs = relationship('Track', secondary=user_likes, back_populates='liked_by')
-
-    class Artist(Base):
-        __tablename__ = 'artists'
-        id = Column(Integer, primary_key=True, autoincrement=True)
-        name = Column(String, nullable=False)
-
-    class Track(Base):
-        __tablename__ = 'tracks'
-        id = Column(BigInteger, primary_key=True, autoincrement=False)
-        title = Column(String, nullable=False)
-        link = Column(String)
-        duration = Column(BigInteger)
-        preview = Column(String)
-        position = Column(BigInteger)
-        rank = Column(BigInteger)
-        explicit_lyrics = Column(Boolean)
-        album_id = Column(BigInteger)
-        album_title = Column(String)
-        album_cover = Column(String)
-        artist_id = Column(BigInteger, ForeignKey('artists.id'))
-        liked_by = relationship('User', secondary=user_likes, back_populates='liked_songs')
+    from sqlalchemy import create_engine, text
 
     engine = create_engine(database_url)
-    SessionLocal = sessionmaker(bind=engine)
-    session = SessionLocal()
-
-    users = session.query(User).all()
-    tracks = session.query(Track).all()
-
-    user_ids = [user.username for user in users]
-    track_ids = [track.id for track in tracks]
-
-    user_idx = {u: i for i, u in enumerate(user_ids)}
-    track_idx = {t: i for i, t in enumerate(track_ids)}
-
-    matrix = np.zeros((len(users), len(tracks)), dtype=np.float32)
-    for user in users:
-        for track in user.liked_songs:
-            if track.id in track_idx:
-                matrix[user_idx[user.username], track_idx[track.id]] = 1.0
+    with engine.connect() as conn:
+        user_ids = [row[0] for row in conn.execute(text("SELECT username FROM users ORDER BY id"))]
+        track_ids = np.fromiter(
+            (row[0] for row in conn.execute(text("SELECT id FROM tracks ORDER BY id"))),
+            dtype=np.int64
+        )
+        user_idx = {u: i for i, u in enumerate(user_ids)}
+        # Read before the likes so nothing committed mid-extract is skipped by the next
+        # incremental run.
+        watermark = conn.execute(text("SELECT max(liked_at) FROM user_likes")).scalar()
+
+        # Server-side cursor: likes arrive in chunks, never as ORM objects or a dense matrix.
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            text("SELECT username, song_id FROM user_likes")
+        )
+        row_chunks, col_chunks = [], []
+        for chunk in result.partitions(chunk_size):
+            songs = np.fromiter((song_id for _, song_id in chunk), dtype=np.int64, count=len(chunk))
+            rows = np.fromiter((user_idx.get(u, -1) for u, _ in chunk), dtype=np.int64, count=len(chunk))
+            cols = np.minimum(np.searchsorted(track_ids, songs), len(track_ids) - 1)
+            valid = (rows >= 0) & (track_ids[cols] == songs)
+            row_chunks.append(rows[valid].astype(np.int32))
+            col_chunks.append(cols[valid].astype(np.int32))
+
+    rows = np.concatenate(row_chunks) if row_chunks else np.empty(0, dtype=np.int32)
+    cols = np.concatenate(col_chunks) if col_chunks else np.empty(0, dtype=np.int32)
+    matrix = sp.coo_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(user_ids), len(track_ids))
+    ).tocsr()
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
 
     os.makedirs(matrix_output.path, exist_ok=True)
     os.makedirs(metadata_output.path, exist_ok=True)
 
-    np.save(os.path.join(matrix_output.path, "matrix.npy"), matrix)
-    with open(os.path.join(metadata_output.path, "meta.pkl"), "wb") as f:
-        pickle.dump({"user_ids": user_ids, "track_ids": track_ids}, f)
-
-    session.close()
+    sp.save_npz(os.path.join(matrix_output.path, "matrix.npz"), matrix)
+    np.save(os.path.join(metadata_output.path, "user_ids.npy"), np.array(user_ids, dtype=str))
+    np.save(os.path.join(metadata_output.path, "track_ids.npy"), track_ids)
+    with open(os.path.join(metadata_output.path, "watermark.txt"), "w") as f:
+        f.write(str(watermark) if watermark else "")
+    print(f"Extracted {matrix.nnz} likes for {len(user_ids)} users x {len(track_ids)} tracks.")
 
 @component(
     base_image="python:3.10",
-    packages_to_install=["torch", "numpy", "pickle5"]
+    packages_to_install=["torch", "numpy", "scipy"]
 )
 def train_model_component(
     matrix_input: Input[Dataset],
     metadata_input: Input[Dataset],
     model_output: Output[Model],
     epochs: int = 30,
-    batch_size: int = 64
+    batch_size: int = 64,
+    num_workers: int = 2,
+    num_threads: int = 0,
+    sparse_input: bool = True
 ):
     import numpy as np
+    import scipy.sparse as sp
     import pickle
+    import hashlib
+    import json
     import os
+    import time
     import torch
     import torch.nn as nn
     import torch.nn.functional as F
 
     os.makedirs(model_output.path, exist_ok=True)
+    if num_threads:
+        torch.set_num_threads(num_threads)
 
     class RecVAE(nn.Module):
         def __init__(self, input_dim, hidden_dim=600, latent_dim=200, dropout=0.5):
@@ -127,8 +116,14 @@ def train_model_component(
             eps = torch.randn_like(std)
             return mu + eps * std
 
-        def forward(self, x):
-            encoded = self.encoder(x)
+        def forward(self, x, x_sparse=None):
+            if x_sparse is not None:
+                # Only the non-zero likes take part in the first (users x tracks) matmul.
+                first = self.encoder[0]
+                hidden = torch.sparse.mm(x_sparse, first.weight.t()) + first.bias
+                encoded = self.encoder[1:](hidden)
+            else:
+                encoded = self.encoder(x)
             mu = self.mu_layer(encoded)
             logvar = self.logvar_layer(encoded)
             z = self.reparameterize(mu, logvar)
@@ -140,35 +135,92 @@ def train_model_component(
             KLD = -0.5 * torch.sum(1 + logvar - mu.pow(2) - logvar.exp())
             return BCE + KLD
 
-    matrix = np.load(os.path.join(matrix_input.path, "matrix.npy"))
-    with open(os.path.join(metadata_input.path, "meta.pkl"), "rb") as f:
-        meta = pickle.load(f)
+    class CSRBatches(torch.utils.data.Dataset):
+        """Each item is a whole mini-batch of rows, densified in the loader worker."""
+
+        def __init__(self, matrix):
+            self.matrix = matrix
+
+        def __len__(self):
+            return self.matrix.shape[0]
+
+        def __getitem__(self, rows):
+            batch = self.matrix[rows].tocoo()
+            return (
+                torch.from_numpy(batch.toarray()),
+                torch.from_numpy(np.vstack([batch.row, batch.col]).astype(np.int64)),
+            )
+
+    matrix = sp.load_npz(os.path.join(matrix_input.path, "matrix.npz")).tocsr()
+    meta = {
+        "user_ids": np.load(os.path.join(metadata_input.path, "user_ids.npy")).tolist(),
+        "track_ids": np.load(os.path.join(metadata_input.path, "track_ids.npy")).tolist(),
+    }
+    watermark_path = os.path.join(metadata_input.path, "watermark.txt")
+    if os.path.exists(watermark_path):
+        with open(watermark_path) as f:
+            meta["watermark"] = f.read().strip() or None
 
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     input_dim = matrix.shape[1]
     model = RecVAE(input_dim).to(device)
     optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
 
+    loader = torch.utils.data.DataLoader(
+        CSRBatches(matrix),
+        batch_size=None,
+        sampler=torch.utils.data.BatchSampler(
+            torch.utils.data.RandomSampler(range(matrix.shape[0])), batch_size, drop_last=False
+        ),
+        num_workers=num_workers,
+        prefetch_factor=4 if num_workers else None,
+        persistent_workers=num_workers > 0,
+        pin_memory=device.type == "cuda",
+    )
+
     model.train()
-    dataset = torch.utils.data.TensorDataset(torch.tensor(matrix, dtype=torch.float32))
-    dataloader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=True)
 
     for epoch in range(epochs):
         epoch_loss = 0
-        for batch in dataloader:
-            x_batch = batch[0].to(device)
+        started = time.perf_counter()
+        for x_dense, coords in loader:
+            x_batch = x_dense.to(device, non_blocking=True)
+            x_sparse = None
+            if sparse_input:
+                x_sparse = torch.sparse_coo_tensor(
+                    coords, torch.ones(coords.shape[1]), size=x_dense.shape
+                ).to(device)
             optimizer.zero_grad()
-            recon_x, mu, logvar = model(x_batch)
+            recon_x, mu, logvar = model(x_batch, x_sparse)
             loss = model.loss_fn(recon_x, x_batch, mu, logvar)
             loss.backward()
             optimizer.step()
             epoch_loss += loss.item()
-        print(f"Epoch {epoch+1}: Loss = {epoch_loss:.2f}")
+        elapsed = time.perf_counter() - started
+        print(f"Epoch {epoch+1}: Loss = {epoch_loss:.2f}, {matrix.shape[0] / elapsed:.0f} users/sec")
 
     torch.save(model.state_dict(), os.path.join(model_output.path, "recvae_model.pt"))
     with open(os.path.join(model_output.path, "recvae_metadata.pkl"), "wb") as f:
         pickle.dump(meta, f)
 
+    # Versioned artifact for memory-mapped serving (see recvae_inference.load_artifact):
+    # one .npy per weight, id maps as arrays, and a manifest with checksums written last.
+    now = time.time()
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f".{int(now * 1e6) % 1000000:06d}Z"
+    artifact_dir = os.path.join(model_output.path, "versions", version)
+    os.makedirs(os.path.join(artifact_dir, "weights"))
+    arrays = {f"weights/{name}": t.detach().cpu().numpy() for name, t in model.state_dict().items()}
+    arrays["track_ids"] = np.asarray(meta["track_ids"], dtype=np.int64)
+    arrays["user_ids"] = np.asarray(meta["user_ids"], dtype=str)
+    files = {}
+    for name, array in arrays.items():
+        path = os.path.join(artifact_dir, f"{name}.npy")
+        np.save(path, array)
+        with open(path, "rb") as f:
+            files[f"{name}.npy"] = hashlib.sha256(f.read()).hexdigest()
+    with open(os.path.join(artifact_dir, "manifest.json"), "w") as f:
+        json.dump({"format": 1, "version": version, "tracks": input_dim, "files": files}, f, indent=2)
+
 @component(
     base_image="python:3.10",
     packages_to_install=["google-cloud-storage"]
@@ -193,6 +245,18 @@ def upload_model_component(
     bucket.blob(f"{prefix}/recvae_model.pt").upload_from_filename(os.path.join(model_path.path, "recvae_model.pt"))
     bucket.blob(f"{prefix}/recvae_metadata.pkl").upload_from_filename(os.path.join(model_path.path, "recvae_metadata.pkl"))
 
+    # Versioned artifacts: upload every file, each manifest last, so a serving process
+    # syncing this prefix never sees a version whose manifest points at missing files.
+    versions_dir = os.path.join(model_path.path, "versions")
+    for version in sorted(os.listdir(versions_dir)) if os.path.isdir(versions_dir) else []:
+        version_dir = os.path.join(versions_dir, version)
+        files = []
+        for root, _, names in os.walk(version_dir):
+            files += [os.path.relpath(os.path.join(root, n), version_dir) for n in names]
+        for name in sorted(files, key=lambda n: n == "manifest.json"):
+            bucket.blob(f"{prefix}/versions/{version}/{name}").upload_from_filename(
+                os.path.join(version_dir, name))
+
 @component(
     base_image="python:3.10",
     packages_to_install=["google-cloud-run", "google-auth"]
@@ -244,6 +308,438 @@ def redeploy_music_recom_component(
     response = operation.result(timeout=300)
     print(f"✅ music-recom Cloud Run service redeployed: {response.uri}")
 
+@component(
+    base_image="python:3.10",
+    packages_to_install=["google-cloud-storage"]
+)
+def download_model_component(
+    gcp_credentials_json: str,
+    output_dir: str,
+    model_output: Output[Model]
+):
+    import os
+    from google.cloud import storage
+
+    credentials_path = "/tmp/gcp_credentials.json"
+    with open(credentials_path, "w") as f:
+        f.write(gcp_credentials_json)
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+
+    client = storage.Client()
+    bucket_name = output_dir.replace("gs://", "").split("/")[0]
+    prefix = "/".join(output_dir.replace("gs://", "").split("/")[1:])
+    bucket = client.bucket(bucket_name)
+    os.makedirs(model_output.path, exist_ok=True)
+    for name in ("recvae_model.pt", "recvae_metadata.pkl"):
+        bucket.blob(f"{prefix}/{name}").download_to_filename(os.path.join(model_output.path, name))
+
+@component(
+    base_image="python:3.10",
+    packages_to_install=["sqlalchemy", "numpy", "scipy", "psycopg2-binary"]
+)
+def extract_delta_component(
+    database_url: str,
+    base_model: Input[Model],
+    matrix_output: Output[Dataset],
+    metadata_output: Output[Dataset],
+    replay_users: int = 2000,
+    chunk_size: int = 100000
+):
+    import numpy as np
+    import scipy.sparse as sp
+    import os
+    import pickle
+    from datetime import datetime
+    from sqlalchemy import bindparam, create_engine, text
+
+    with open(os.path.join(base_model.path, "recvae_metadata.pkl"), "rb") as f:
+        base_meta = pickle.load(f)
+    if not base_meta.get("watermark"):
+        raise ValueError("Base model has no like watermark; run the full pipeline once first.")
+    since = datetime.fromisoformat(base_meta["watermark"])
+
+    # Full current rows of every user who liked something since the watermark, plus a
+    # random replay sample of other users so fine-tuning does not forget them. Cost
+    # follows the number of touched users, not the size of user_likes.
+    touched_sql = "SELECT DISTINCT username FROM user_likes WHERE liked_at > :since"
+    # Replay users are drawn by random primary key, so the cost follows the sample size,
+    # and only users with likes are kept: an empty row would teach the model they like
+    # nothing. EXISTS is a probe of the user_likes primary key.
+    replay_sql = text(
+        "SELECT username FROM users AS u WHERE u.id IN :ids "
+        "AND EXISTS (SELECT 1 FROM user_likes AS l WHERE l.username = u.username)"
+    ).bindparams(bindparam("ids", expanding=True))
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        track_ids = np.fromiter(
+            (row[0] for row in conn.execute(text("SELECT id FROM tracks ORDER BY id"))),
+            dtype=np.int64
+        )
+        watermark = conn.execute(
+            text("SELECT max(liked_at) FROM user_likes WHERE liked_at > :since"), {"since": since}
+        ).scalar() or since
+        touched = [row[0] for row in conn.execute(text(touched_sql), {"since": since})]
+        max_user_id = conn.execute(text("SELECT max(id) FROM users")).scalar() or 0
+        rng = np.random.default_rng()
+        replay, exclude = [], set(touched)
+        # Ids can have gaps and users without likes; oversample and retry a few times.
+        for _ in range(5):
+            wanted = replay_users - len(replay)
+            if wanted <= 0 or not max_user_id:
+                break
+            ids = np.unique(rng.integers(1, max_user_id + 1, size=3 * wanted)).tolist()
+            for username in rng.permutation(conn.execute(replay_sql, {"ids": ids}).scalars().all()):
+                if username not in exclude and len(replay) < replay_users:
+                    replay.append(str(username))
+                    exclude.add(username)
+        user_ids = list(dict.fromkeys(touched + replay))
+        user_idx = {u: i for i, u in enumerate(user_ids)}
+
+        # The sampled list itself, not the sampling query again: random() would pick others.
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            text("SELECT username, song_id FROM user_likes WHERE username IN :users").bindparams(
+                bindparam("users", expanding=True)
+            ),
+            {"users": user_ids},
+        )
+        row_chunks, col_chunks = [], []
+        for chunk in result.partitions(chunk_size):
+            songs = np.fromiter((song_id for _, song_id in chunk), dtype=np.int64, count=len(chunk))
+            rows = np.fromiter((user_idx.get(u, -1) for u, _ in chunk), dtype=np.int64, count=len(chunk))
+            cols = np.minimum(np.searchsorted(track_ids, songs), len(track_ids) - 1)
+            valid = (rows >= 0) & (track_ids[cols] == songs)
+            row_chunks.append(rows[valid].astype(np.int32))
+            col_chunks.append(cols[valid].astype(np.int32))
+
+    rows = np.concatenate(row_chunks) if row_chunks else np.empty(0, dtype=np.int32)
+    cols = np.concatenate(col_chunks) if col_chunks else np.empty(0, dtype=np.int32)
+    matrix = sp.coo_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(user_ids), len(track_ids))
+    ).tocsr()
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+
+    os.makedirs(matrix_output.path, exist_ok=True)
+    os.makedirs(metadata_output.path, exist_ok=True)
+
+    sp.save_npz(os.path.join(matrix_output.path, "matrix.npz"), matrix)
+    np.save(os.path.join(metadata_output.path, "user_ids.npy"), np.array(user_ids, dtype=str))
+    np.save(os.path.join(metadata_output.path, "track_ids.npy"), track_ids)
+    with open(os.path.join(metadata_output.path, "watermark.txt"), "w") as f:
+        f.write(str(watermark))
+    print(f"Extracted {matrix.nnz} likes for {len(touched)} touched + {len(user_ids) - len(touched)} "
+          f"replay users since {since.isoformat()}.")
+
+@component(
+    base_image="python:3.10",
+    packages_to_install=["torch", "numpy", "scipy"]
+)
+def finetune_model_component(
+    matrix_input: Input[Dataset],
+    metadata_input: Input[Dataset],
+    base_model: Input[Model],
+    model_output: Output[Model],
+    max_epochs: int = 5,
+    patience: int = 1,
+    holdout_fraction: float = 0.1,
+    min_holdout: int = 20,
+    batch_size: int = 64,
+    lr: float = 0.0005
+):
+    import numpy as np
+    import scipy.sparse as sp
+    import pickle
+    import hashlib
+    import json
+    import os
+    import time
+    import torch
+    import torch.nn as nn
+    import torch.nn.functional as F
+
+    os.makedirs(model_output.path, exist_ok=True)
+
+    class RecVAE(nn.Module):
+        def __init__(self, input_dim, hidden_dim=600, latent_dim=200, dropout=0.5):
+            super(RecVAE, self).__init__()
+            self.encoder = nn.Sequential(
+                nn.Linear(input_dim, hidden_dim),
+                nn.Tanh(),
+                nn.Dropout(dropout),
+                nn.Linear(hidden_dim, hidden_dim),
+                nn.Tanh(),
+                nn.Dropout(dropout)
+            )
+            self.mu_layer = nn.Linear(hidden_dim, latent_dim)
+            self.logvar_layer = nn.Linear(hidden_dim, latent_dim)
+            self.decoder = nn.Sequential(
+                nn.Linear(latent_dim, hidden_dim),
+                nn.Tanh(),
+                nn.Dropout(dropout),
+                nn.Linear(hidden_dim, input_dim),
+            )
+
+        def reparameterize(self, mu, logvar):
+            std = torch.exp(0.5 * logvar)
+            eps = torch.randn_like(std)
+            return mu + eps * std
+
+        def forward(self, x):
+            encoded = self.encoder(x)
+            mu = self.mu_layer(encoded)
+            logvar = self.logvar_layer(encoded)
+            z = self.reparameterize(mu, logvar) if self.training else mu
+            decoded = self.decoder(z)
+            return decoded, mu, logvar
+
+        def loss_fn(self, recon_x, x, mu, logvar):
+            BCE = F.binary_cross_entropy_with_logits(recon_x, x, reduction='sum')
+            KLD = -0.5 * torch.sum(1 + logvar - mu.pow(2) - logvar.exp())
+            return BCE + KLD
+
+    matrix = sp.load_npz(os.path.join(matrix_input.path, "matrix.npz")).tocsr()
+    track_ids = np.load(os.path.join(metadata_input.path, "track_ids.npy"))
+    with open(os.path.join(metadata_input.path, "watermark.txt")) as f:
+        watermark = f.read().strip()
+    with open(os.path.join(base_model.path, "recvae_metadata.pkl"), "rb") as f:
+        base_meta = pickle.load(f)
+    base_state = torch.load(os.path.join(base_model.path, "recvae_model.pt"), map_location="cpu")
+
+    # Grow the track-sized layers: tracks the base model knew keep their learned columns
+    # (input layer) and rows (output layer); new tracks keep the fresh initialisation and
+    # removed tracks are dropped.
+    model = RecVAE(len(track_ids))
+    state = model.state_dict()
+    old_ids = np.asarray(base_meta["track_ids"], dtype=np.int64)
+    old_pos = np.minimum(np.searchsorted(old_ids, track_ids), len(old_ids) - 1)
+    kept = old_ids[old_pos] == track_ids
+    new_cols, old_cols = torch.from_numpy(np.flatnonzero(kept)), torch.from_numpy(old_pos[kept])
+    for name, tensor in base_state.items():
+        if name == "encoder.0.weight":
+            state[name][:, new_cols] = tensor[:, old_cols]
+        elif name in ("decoder.3.weight", "decoder.3.bias"):
+            state[name][new_cols] = tensor[old_cols]
+        else:
+            state[name] = tensor
+    model.load_state_dict(state)
+    print(f"Warm start: {int(kept.sum())} known tracks, {int((~kept).sum())} new, "
+          f"{len(old_ids) - int(kept.sum())} removed.")
+
+    rng = np.random.default_rng(0)
+    order = rng.permutation(matrix.shape[0])
+    n_holdout = int(len(order) * holdout_fraction)
+    if n_holdout < min_holdout:
+        # Too few users to judge an epoch: train on all of them and keep the last epoch.
+        print(f"Holdout of {n_holdout} users is below {min_holdout}; no early stopping.")
+        n_holdout = 0
+    holdout, train_rows = order[:n_holdout], order[n_holdout:]
+
+    def holdout_loss():
+        model.eval()
+        total = 0.0
+        with torch.no_grad():
+            for start in range(0, len(holdout), batch_size):
+                x = torch.from_numpy(matrix[holdout[start:start + batch_size]].toarray())
+                recon_x, mu, logvar = model(x)
+                total += model.loss_fn(recon_x, x, mu, logvar).item()
+        return total / len(holdout)
+
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    best_loss, best_state, stale = (holdout_loss() if len(holdout) else None), None, 0
+    if len(holdout):
+        print(f"Base model holdout loss: {best_loss:.3f}")
+    for epoch in range(max_epochs):
+        started = time.perf_counter()
+        model.train()
+        rng.shuffle(train_rows)
+        for start in range(0, len(train_rows), batch_size):
+            x = torch.from_numpy(matrix[train_rows[start:start + batch_size]].toarray())
+            optimizer.zero_grad()
+            recon_x, mu, logvar = model(x)
+            loss = model.loss_fn(recon_x, x, mu, logvar)
+            loss.backward()
+            optimizer.step()
+        if not len(holdout):
+            print(f"Epoch {epoch+1}: {time.perf_counter() - started:.1f}s")
+            continue
+        loss = holdout_loss()
+        print(f"Epoch {epoch+1}: holdout loss = {loss:.3f}, {time.perf_counter() - started:.1f}s")
+        if loss < best_loss:
+            best_loss, stale = loss, 0
+            best_state = {k: v.clone() for k, v in model.state_dict().items()}
+        else:
+            stale += 1
+            if stale > patience:
+                print("Early stopping.")
+                break
+    # No epoch beat the grown base model on the holdout: ship the base weights. Without
+    # a holdout the model is left at its last epoch.
+    if best_state is not None:
+        model.load_state_dict(best_state)
+
+    new_users = np.load(os.path.join(metadata_input.path, "user_ids.npy")).tolist()
+    meta = {
+        "user_ids": list(dict.fromkeys(base_meta["user_ids"] + new_users)),
+        "track_ids": track_ids.tolist(),
+        "watermark": watermark,
+    }
+    torch.save(model.state_dict(), os.path.join(model_output.path, "recvae_model.pt"))
+    with open(os.path.join(model_output.path, "recvae_metadata.pkl"), "wb") as f:
+        pickle.dump(meta, f)
+
+    # Same versioned artifact layout as train_model_component.
+    now = time.time()
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f".{int(now * 1e6) % 1000000:06d}Z"
+    artifact_dir = os.path.join(model_output.path, "versions", version)
+    os.makedirs(os.path.join(artifact_dir, "weights"))
+    arrays = {f"weights/{name}": t.detach().cpu().numpy() for name, t in model.state_dict().items()}
+    arrays["track_ids"] = np.asarray(meta["track_ids"], dtype=np.int64)
+    arrays["user_ids"] = np.asarray(meta["user_ids"], dtype=str)
+    files = {}
+    for name, array in arrays.items():
+        path = os.path.join(artifact_dir, f"{name}.npy")
+        np.save(path, array)
+        with open(path, "rb") as f:
+            files[f"{name}.npy"] = hashlib.sha256(f.read()).hexdigest()
+    with open(os.path.join(artifact_dir, "manifest.json"), "w") as f:
+        json.dump({"format": 1, "version": version, "tracks": len(track_ids), "files": files}, f, indent=2)
+
+@component(
+    base_image="python:3.10",
+    packages_to_install=["torch", "numpy", "scipy", "sqlalchemy", "psycopg2-binary"]
+)
+def materialize_recommendations_component(
+    database_url: str,
+    matrix_input: Input[Dataset],
+    metadata_input: Input[Dataset],
+    model_input: Input[Model],
+    top_n: int = 100,
+    batch_size: int = 512
+):
+    import io
+    import os
+    import time
+    import numpy as np
+    import scipy.sparse as sp
+    import torch
+    import torch.nn as nn
+    import psycopg2.errors
+    from sqlalchemy import create_engine
+
+    class RecVAE(nn.Module):
+        def __init__(self, input_dim, hidden_dim=600, latent_dim=200, dropout=0.5):
+            super(RecVAE, self).__init__()
+            self.encoder = nn.Sequential(
+                nn.Linear(input_dim, hidden_dim),
+                nn.Tanh(),
+                nn.Dropout(dropout),
+                nn.Linear(hidden_dim, hidden_dim),
+                nn.Tanh(),
+                nn.Dropout(dropout)
+            )
+            self.mu_layer = nn.Linear(hidden_dim, latent_dim)
+            self.logvar_layer = nn.Linear(hidden_dim, latent_dim)
+            self.decoder = nn.Sequential(
+                nn.Linear(latent_dim, hidden_dim),
+                nn.Tanh(),
+                nn.Dropout(dropout),
+                nn.Linear(hidden_dim, input_dim),
+            )
+
+    matrix = sp.load_npz(os.path.join(matrix_input.path, "matrix.npz")).tocsr()
+    user_ids = np.load(os.path.join(metadata_input.path, "user_ids.npy"))
+    track_ids = np.load(os.path.join(metadata_input.path, "track_ids.npy"))
+    watermark_path = os.path.join(metadata_input.path, "watermark.txt")
+    watermark = None
+    if os.path.exists(watermark_path):
+        with open(watermark_path) as f:
+            watermark = f.read().strip() or None
+
+    model = RecVAE(matrix.shape[1])
+    model.load_state_dict(torch.load(os.path.join(model_input.path, "recvae_model.pt"), map_location="cpu"))
+    model.eval()
+    versions_dir = os.path.join(model_input.path, "versions")
+    version = sorted(os.listdir(versions_dir))[-1] if os.path.isdir(versions_dir) else "legacy"
+
+    def escape(value):
+        # COPY text format
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    engine = create_engine(database_url)
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS user_recommendations (username VARCHAR PRIMARY KEY, "
+            "model_version VARCHAR NOT NULL, track_ids BIGINT[] NOT NULL, computed_at TIMESTAMPTZ DEFAULT now())"
+        )
+        raw.commit()
+        # Loaded into a separate table without an index and committed; serving keeps
+        # reading the old table until the short rename transaction at the end.
+        cur.execute("DROP TABLE IF EXISTS user_recommendations_load")
+        cur.execute("CREATE TABLE user_recommendations_load (LIKE user_recommendations INCLUDING DEFAULTS)")
+
+        # Dense scores cost batch_size x tracks floats; users without likes are left to
+        # the live popularity fallback.
+        active = np.flatnonzero(np.diff(matrix.indptr))
+        k = min(top_n, matrix.shape[1])
+        started = time.perf_counter()
+        with torch.inference_mode():
+            for start in range(0, len(active), batch_size):
+                rows = active[start:start + batch_size]
+                x = torch.from_numpy(matrix[rows].toarray())
+                scores = model.decoder(model.mu_layer(model.encoder(x)))
+                scores[x > 0] = -float("inf")
+                values, top = torch.topk(scores, k, dim=1)
+                finite = torch.isfinite(values).numpy()
+                ranked = track_ids[top.numpy()]
+                buffer = io.StringIO()
+                for user, ids, keep in zip(user_ids[rows].tolist(), ranked, finite):
+                    buffer.write(f"{escape(user)}\t{version}\t{{{','.join(map(str, ids[keep].tolist()))}}}\n")
+                buffer.seek(0)
+                cur.copy_expert(
+                    "COPY user_recommendations_load (username, model_version, track_ids) FROM STDIN", buffer
+                )
+        print(f"Scored {len(active)} users in {time.perf_counter() - started:.1f}s.")
+
+        if watermark:
+            # Users who liked something after the extract get live scores instead.
+            cur.execute(
+                "DELETE FROM user_recommendations_load r USING user_likes l "
+                "WHERE l.username = r.username AND l.liked_at > %s",
+                (watermark,),
+            )
+        cur.execute("ALTER TABLE user_recommendations_load ADD PRIMARY KEY (username)")
+        cur.execute("ANALYZE user_recommendations_load")
+        cur.execute("DROP TABLE IF EXISTS user_recommendations_old")
+        raw.commit()
+
+        # The renames take ACCESS EXCLUSIVE locks, which queue behind running reads and
+        # block new ones while queued; lock_timeout bounds that stall, and the swap is
+        # retried rather than left waiting.
+        for attempt in range(10):
+            try:
+                cur.execute("SET LOCAL lock_timeout = '2s'")
+                cur.execute("ALTER TABLE user_recommendations RENAME TO user_recommendations_old")
+                cur.execute("ALTER INDEX IF EXISTS user_recommendations_pkey RENAME TO user_recommendations_old_pkey")
+                cur.execute("ALTER TABLE user_recommendations_load RENAME TO user_recommendations")
+                cur.execute("ALTER INDEX user_recommendations_load_pkey RENAME TO user_recommendations_pkey")
+                raw.commit()
+                break
+            except psycopg2.errors.LockNotAvailable:
+                raw.rollback()
+                print(f"Swap attempt {attempt + 1} timed out waiting for readers; retrying.")
+                time.sleep(5)
+        else:
+            raise RuntimeError("Could not swap in user_recommendations_load; it is left for the next run.")
+        # Nothing reads the old table any more, so its drop does not wait on serving.
+        cur.execute("DROP TABLE user_recommendations_old")
+        raw.commit()
+    finally:
+        raw.close()
+    print(f"Materialized top-{top_n} recommendations of model {version}.")
+
 @pipeline(name="recvae-training-pipeline")
 def recvae_pipeline(
     database_url: str,
@@ -259,6 +755,15 @@ def recvae_pipeline(
         metadata_input=extract_op.outputs["metadata_output"]
     )
 
+    # Schedule this pipeline nightly: every user's top-N is scored and bulk-loaded into
+    # user_recommendations, which /ml-recommendations reads by primary key.
+    materialize_recommendations_component(
+        database_url=database_url,
+        matrix_input=extract_op.outputs["matrix_output"],
+        metadata_input=extract_op.outputs["metadata_output"],
+        model_input=train_op.outputs["model_output"]
+    )
+
     upload_op = upload_model_component(
         model_path=train_op.outputs["model_output"],
         gcp_credentials_json=gcp_credentials_json,
@@ -272,7 +777,51 @@ def recvae_pipeline(
     )
     redeploy_op.after(upload_op)
 
+@pipeline(name="recvae-incremental-pipeline")
+def recvae_incremental_pipeline(
+    database_url: str,
+    gcp_credentials_json: str,
+    output_dir: str,
+    project_id: str,
+    region: str,
+):
+    # Warm-starts from the model last uploaded to output_dir and only reads likes newer
+    # than its watermark; run recvae_pipeline once first to seed the watermark.
+    base_op = download_model_component(
+        gcp_credentials_json=gcp_credentials_json,
+        output_dir=output_dir
+    )
+
+    extract_op = extract_delta_component(
+        database_url=database_url,
+        base_model=base_op.outputs["model_output"]
+    )
+
+    finetune_op = finetune_model_component(
+        matrix_input=extract_op.outputs["matrix_output"],
+        metadata_input=extract_op.outputs["metadata_output"],
+        base_model=base_op.outputs["model_output"]
+    )
+
+    upload_op = upload_model_component(
+        model_path=finetune_op.outputs["model_output"],
+        gcp_credentials_json=gcp_credentials_json,
+        output_dir=output_dir
+    )
+
+    redeploy_op = redeploy_music_recom_component(
+        gcp_credentials_json=gcp_credentials_json,
+        project_id=project_id,
+        region=region
+    )
+    redeploy_op.after(upload_op)
+
 compiler.Compiler().compile(
     pipeline_func=recvae_pipeline,
     package_path="recvae_pipeline.json"
+)
+
+compiler.Compiler().compile(
+    pipeline_func=recvae_incremental_pipeline,
+    package_path="recvae_incremental_pipeline.json"
 )
\ No newline at end of file
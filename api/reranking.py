@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from db_models import Track
+
+# Candidates fetched from a recommender before re-ranking down to the requested count.
+RERANK_POOL = int(os.environ.get("RERANK_POOL", "100"))
+RERANK_ARTIST_CAP = int(os.environ.get("RERANK_ARTIST_CAP", "2"))
+# MMR trade-off: weight of "same artist as something already picked" against relevance.
+RERANK_DIVERSITY = float(os.environ.get("RERANK_DIVERSITY", "0.3"))
+RERANK_POPULARITY_PENALTY = float(os.environ.get("RERANK_POPULARITY_PENALTY", "0.1"))
+RERANK_REFRESH_SECONDS = float(os.environ.get("RERANK_REFRESH_SECONDS", "300"))
+
+
+class TrackFeatures:
+    """artist_id, popularity and explicit_lyrics per track, as arrays sorted by id.
+
+    Re-ranking looks candidates up here instead of querying the tracks table. Reloaded
+    after `invalidate()` or every RERANK_REFRESH_SECONDS, or attached from a shared_state
+    snapshot, like TrackSampler.
+    """
+
+    def __init__(self, refresh_seconds: float = RERANK_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        # (ids, artist ids, popularity in [0, 1], explicit, loaded_at)
+        self._state = None
+        self.shared = False
+
+    @staticmethod
+    def _query():
+        return select(Track.id, Track.artist_id, Track.rank, Track.explicit_lyrics).order_by(Track.id)
+
+    def _build(self, rows):
+        n = len(rows)
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+        # A track without an artist only counts as its own artist.
+        artists = np.fromiter((r[1] if r[1] is not None else -r[0] for r in rows), dtype=np.int64, count=n)
+        ranks = np.log1p(np.fromiter((max(r[2] or 0, 0) for r in rows), dtype=np.float64, count=n))
+        popularity = ranks / ranks.max() if n and ranks.max() > 0 else ranks
+        explicit = np.fromiter((bool(r[3]) for r in rows), dtype=bool, count=n)
+        self._state = (ids, artists, popularity, explicit, time.monotonic())
+        self.shared = False
+
+    def load(self, db: Session):
+        self._build(db.execute(self._query()).all())
+
+    async def load_async(self, db):
+        result = await db.execute(self._query())
+        self._build(result.all())
+
+    def save(self, path: str):
+        """Write the arrays as features_*.npy for attach() in other processes."""
+        for name, values in zip(("ids", "artists", "popularity", "explicit"), self._state[:4]):
+            np.save(os.path.join(path, f"features_{name}.npy"), values)
+
+    def attach(self, path: str):
+        def array(name):
+            return np.load(os.path.join(path, f"features_{name}.npy"), mmap_mode="r")
+
+        self._state = (array("ids"), array("artists"), array("popularity"), array("explicit"), time.monotonic())
+        self.shared = True
+
+    def stale(self) -> bool:
+        state = self._state
+        if state is not None and self.shared:
+            return False
+        return state is None or time.monotonic() - state[4] > self.refresh_seconds
+
+    def invalidate(self):
+        self._state = None
+
+    def current(self, db: Session):
+        state = self._state
+        if self.stale():
+            with self._lock:
+                if self._state is state:
+                    self.load(db)
+                state = self._state
+        return state
+
+    async def current_async(self, db):
+        if self.stale():
+            await self.load_async(db)
+        return self._state
+
+
+class Reranker:
+    """Post-scoring stage over a candidate pool of a few hundred tracks.
+
+    Filtering, score adjustments and the diverse selection are all NumPy ops over the
+    pool, with no per-candidate Python loop. `stages` holds extra callables pool -> pool
+    run before selection, where a pool is a dict of equal-length arrays: ids, relevance,
+    artist, popularity, explicit.
+    """
+
+    def __init__(self, artist_cap: int = RERANK_ARTIST_CAP, diversity: float = RERANK_DIVERSITY,
+                 popularity_penalty: float = RERANK_POPULARITY_PENALTY):
+        self.artist_cap = artist_cap
+        self.diversity = diversity
+        self.popularity_penalty = popularity_penalty
+        self.stages = []
+
+    def pool(self, features, track_ids, scores=None, allow_explicit: bool = True) -> dict:
+        """Candidates joined with their features; ids missing from the catalogue are dropped."""
+        ids = np.asarray(track_ids, dtype=np.int64)
+        # Recommenders that only return an order get linearly decreasing scores.
+        scores = np.asarray(scores, dtype=np.float64) if scores is not None else -np.arange(len(ids), dtype=np.float64)
+        known_ids, artists, popularity, explicit, _ = features
+        if not len(ids) or not len(known_ids):
+            return {"ids": ids[:0], "relevance": scores[:0], "artist": ids[:0],
+                    "popularity": scores[:0], "explicit": np.zeros(0, dtype=bool)}
+        pos = np.minimum(np.searchsorted(known_ids, ids), len(known_ids) - 1)
+        known = known_ids[pos] == ids
+        if not allow_explicit:
+            known &= ~explicit[pos]
+        ids, scores, pos = ids[known], scores[known], pos[known]
+
+        # Recommender scores live on different scales; min-max puts them on [0, 1] so the
+        # penalty and diversity weights mean the same thing for every engine.
+        spread = scores.max() - scores.min() if len(scores) else 0.0
+        relevance = (scores - scores.min()) / spread if spread > 0 else np.ones(len(scores))
+        return {
+            "ids": ids,
+            "relevance": relevance - self.popularity_penalty * popularity[pos],
+            "artist": artists[pos],
+            "popularity": popularity[pos],
+            "explicit": explicit[pos],
+        }
+
+    def select(self, pool: dict, k: int):
+        """Greedy MMR with "same artist" as the similarity, under the per-artist cap.
+
+        Redundancy is 1 exactly for tracks whose artist was already picked, and each
+        artist's tracks are taken in relevance order, so a track's MMR gain is fixed by
+        its rank within its artist and the greedy selection reduces to one sort.
+        """
+        ids, relevance = pool["ids"], pool["relevance"]
+        k = min(k, len(ids))
+        if k <= 0:
+            return []
+        by_artist = np.lexsort((-relevance, pool["artist"]))
+        artists = pool["artist"][by_artist]
+        starts = np.flatnonzero(np.r_[True, artists[1:] != artists[:-1]])
+        within = np.empty(len(ids), dtype=np.int64)
+        within[by_artist] = np.arange(len(ids)) - np.repeat(starts, np.diff(np.r_[starts, len(ids)]))
+
+        gain = relevance - self.diversity * (within > 0)
+        # Over the cap only when the pool has too few artists to fill k.
+        capped = within >= self.artist_cap if self.artist_cap else np.zeros(len(ids), dtype=bool)
+        order = np.lexsort((-gain, capped))[:k]
+        return ids[order].tolist()
+
+    def rerank(self, features, track_ids, scores=None, k: int = 10, allow_explicit: bool = True):
+        """Top-k of the candidates after filtering, popularity penalty, stages and MMR."""
+        pool = self.pool(features, track_ids, scores, allow_explicit)
+        for stage in self.stages:
+            pool = stage(pool)
+        return self.select(pool, k)
+
+
+track_features = TrackFeatures()
+reranker = Reranker()
@@ -0,0 +1,26 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+
+class LoginRequest(BaseModel):
+    username: str
+
+class BatchLikeRequest(BaseModel):
+    song_ids: List[int]
+
+class SongOut(BaseModel):
+    id: float
+    title: str
+    link: str
+    duration: int
+    preview: str
+    position: Optional[float] = None
+    rank: float
+    explicit_lyrics: bool
+    album_id: float
+    album_title: str
+    album_cover: str
+    artist_id: float
+
+    class Config:
+        orm_mode = True
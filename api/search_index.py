@@ -0,0 +1,174 @@
+import math
+import os
+from array import array
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from db_models import Artist, Track
+
+SEARCH_REFRESH_SECONDS = float(os.environ.get("SEARCH_REFRESH_SECONDS", "600"))
+SEARCH_MIN_SIMILARITY = float(os.environ.get("SEARCH_MIN_SIMILARITY", "0.5"))
+SEARCH_MAX_CANDIDATES = int(os.environ.get("SEARCH_MAX_CANDIDATES", "20000"))
+# Weight of the popularity prior next to trigram similarity (0..1).
+SEARCH_RANK_WEIGHT = float(os.environ.get("SEARCH_RANK_WEIGHT", "0.2"))
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[\W_]+", " ", text.lower()).strip()
+
+
+def trigrams(text: str, prefix: bool = False) -> set:
+    """pg_trgm-style trigrams: every word padded with two leading and one trailing space.
+
+    With `prefix`, the last word is left open on the right so "beatl" matches "beatles".
+    """
+    words = normalize(text).split()
+    grams = set()
+    for i, word in enumerate(words):
+        padded = "  " + word + ("" if prefix and i == len(words) - 1 else " ")
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+
+class SearchIndex:
+    """In-memory trigram inverted index over track title, album title and artist name.
+
+    Documents are numbered in descending Deezer rank, so every posting list is sorted by
+    popularity too: when a very common query has more candidates than
+    SEARCH_MAX_CANDIDATES, only the most popular ones are scored.
+    """
+
+    def __init__(self, refresh_seconds: float = SEARCH_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._building = threading.Lock()
+        # (track ids, popularity prior, {gram: (start, stop)}, postings, built_at)
+        self._state = None
+        self._stale = False
+        # Attached from a shared_state snapshot: refreshed by the publisher, not rebuilt here.
+        self.shared = False
+
+    @property
+    def ready(self) -> bool:
+        return self._state is not None
+
+    def load(self, db: Session):
+        rows = db.execute(
+            select(Track.id, Track.title, Track.album_title, Artist.name, Track.rank)
+            .outerjoin(Artist, Track.artist_id == Artist.id)
+            .order_by(Track.rank.desc().nulls_last(), Track.id)
+        ).all()
+        # (gram id, doc) pairs in compact arrays; grouping them by gram keeps each
+        # posting list in ascending doc order.
+        gram_ids, gram_col, doc_col = {}, array("i"), array("i")
+        for doc, (_, title, album, artist, _) in enumerate(rows):
+            for gram in trigrams(f"{title or ''} {artist or ''} {album or ''}"):
+                gram_col.append(gram_ids.setdefault(gram, len(gram_ids)))
+                doc_col.append(doc)
+        grams = np.frombuffer(gram_col, dtype=np.int32)
+        flat = np.frombuffer(doc_col, dtype=np.int32)[np.argsort(grams, kind="stable")]
+        bounds = np.zeros(len(gram_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(grams, minlength=len(gram_ids)), out=bounds[1:])
+        offsets = {gram: (int(bounds[i]), int(bounds[i + 1])) for gram, i in gram_ids.items()}
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        ranks = np.log1p(np.fromiter((max(r[4] or 0, 0) for r in rows), dtype=np.float64, count=len(rows)))
+        prior = ranks / ranks.max() if len(ranks) and ranks.max() > 0 else ranks
+        self._state = (ids, prior, offsets, flat, time.monotonic())
+        self._stale = False
+        self.shared = False
+        print(f"Search index built: {len(ids)} tracks, {len(offsets)} trigrams.")
+
+    def save(self, path: str):
+        """Write the index as search_*.npy arrays for attach() in other processes."""
+        ids, prior, offsets, flat, _ = self._state
+        grams = list(offsets)
+        arrays = {
+            "ids": ids,
+            "prior": prior,
+            "postings": flat,
+            "grams": np.array(grams, dtype=str),
+            "bounds": np.array([offsets[g] for g in grams], dtype=np.int64).reshape(-1, 2),
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(path, f"search_{name}.npy"), values)
+
+    def attach(self, path: str):
+        def array(name):
+            return np.load(os.path.join(path, f"search_{name}.npy"), mmap_mode="r")
+
+        # Only the gram dictionary is private; it is bounded by the alphabet, not the catalogue.
+        bounds = np.asarray(array("bounds")).tolist()
+        offsets = {g: tuple(b) for g, b in zip(array("grams").tolist(), bounds)}
+        self._state = (array("ids"), array("prior"), offsets, array("postings"), time.monotonic())
+        self._stale = False
+        self.shared = True
+
+    def rebuild(self, session_factory):
+        if not self._building.acquire(blocking=False):
+            return
+        try:
+            db = session_factory()
+            try:
+                self.load(db)
+            finally:
+                db.close()
+        finally:
+            self._building.release()
+
+    def rebuild_in_background(self, session_factory):
+        threading.Thread(target=self.rebuild, args=(session_factory,), daemon=True).start()
+
+    def invalidate(self):
+        self._stale = True
+
+    def stale(self) -> bool:
+        state = self._state
+        if state is not None and self.shared:
+            return False
+        return state is None or self._stale or time.monotonic() - state[4] > self.refresh_seconds
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, prefix: bool = True,
+               min_similarity: float = SEARCH_MIN_SIMILARITY):
+        """Track ids ordered by trigram similarity plus a popularity prior."""
+        ids, prior, offsets, flat, _ = self._state
+        grams = trigrams(query, prefix)
+        if not grams:
+            return []
+        lists = sorted(
+            (flat[slice(*offsets[g])] if g in offsets else flat[:0] for g in grams), key=len
+        )
+        need = max(1, math.ceil(len(lists) * min_similarity))
+        if len(normalize(query)) < 4:
+            # Too short to be fuzzy: "ab" must match both "  a" and " ab".
+            need = len(lists)
+        # A document sharing `need` of n trigrams must appear in one of the n - need + 1
+        # shortest lists, so those alone produce every candidate.
+        seeds = [p[:SEARCH_MAX_CANDIDATES] for p in lists[:len(lists) - need + 1]]
+        candidates = np.unique(np.concatenate(seeds))[:SEARCH_MAX_CANDIDATES]
+        if not len(candidates):
+            return []
+
+        matched = np.zeros(len(candidates), dtype=np.int32)
+        for posting in lists:
+            if len(posting):
+                pos = np.minimum(np.searchsorted(posting, candidates), len(posting) - 1)
+                matched += posting[pos] == candidates
+        keep = matched >= need
+        candidates = candidates[keep]
+        scores = matched[keep] / len(lists) + SEARCH_RANK_WEIGHT * prior[candidates]
+
+        stop = min(offset + limit, len(candidates))
+        if stop <= offset:
+            return []
+        top = np.argpartition(-scores, stop - 1)[:stop] if stop < len(scores) else np.arange(len(scores))
+        # Ties fall back to document order, i.e. popularity.
+        top = top[np.lexsort((candidates[top], -scores[top]))]
+        return ids[candidates[top[offset:stop]]].tolist()
+
+
+search_index = SearchIndex()
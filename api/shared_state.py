@@ -0,0 +1,193 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+
+SHARED_STATE_DIR = os.environ.get("SHARED_STATE_DIR", "")
+SHARED_STATE_REFRESH_SECONDS = float(os.environ.get("SHARED_STATE_REFRESH_SECONDS", "300"))
+SHARED_STATE_WATCH_SECONDS = float(os.environ.get("SHARED_STATE_WATCH_SECONDS", "10"))
+SHARED_STATE_KEEP = int(os.environ.get("SHARED_STATE_KEEP", "3"))
+
+# Multi-process serving: one loader publishes the like graph, the search index, the
+# track sampler and the re-ranking features as snapshots, and every uvicorn worker maps them read-only, so N workers share a single
+# copy in the page cache and start without touching the likes table:
+#
+#     SHARED_STATE_DIR=state python shared_state.py &
+#     SHARED_STATE_DIR=state uvicorn app:app --workers 8
+#
+# <SHARED_STATE_DIR>/versions/<version>/ holds one .npy per array plus manifest.json,
+# written last, like the model artifacts. RecVAE weights, the ANN index and the item-kNN
+# index are already memory-mapped from their own directories; the loader converts a
+# legacy checkpoint and verifies checksums once so workers can skip that.
+
+current = None  # manifest of the attached snapshot
+_watcher = None
+_verified = {}  # model version path -> ok
+
+
+def latest_snapshot(state_dir: str = SHARED_STATE_DIR):
+    root = os.path.join(state_dir, "versions")
+    if not os.path.isdir(root):
+        return None
+    versions = sorted(
+        v for v in os.listdir(root)
+        if not v.endswith(".tmp") and os.path.exists(os.path.join(root, v, "manifest.json"))
+    )
+    return os.path.join(root, versions[-1]) if versions else None
+
+
+def _prepare_model(model_dir: str):
+    """Newest model version, converted from a legacy checkpoint if needed and verified."""
+    if not model_dir or not os.path.isdir(model_dir):
+        return None
+    from recvae_inference import convert_legacy, latest_version, load_artifact
+
+    path = latest_version(model_dir)
+    if not path and os.path.exists(os.path.join(model_dir, "recvae_model.pt")):
+        path = convert_legacy(model_dir)
+    if path and path not in _verified:
+        try:
+            load_artifact(path, verify=True)
+            _verified[path] = True
+        except Exception as e:
+            print(f"Not vouching for model at {path}: {e}")
+            _verified[path] = False
+    return path if path and _verified[path] else None
+
+
+def _prune(state_dir: str, keep: int = SHARED_STATE_KEEP):
+    # Workers still mapping an old version keep its pages after the files are unlinked.
+    root = os.path.join(state_dir, "versions")
+    versions = sorted(v for v in os.listdir(root) if not v.endswith(".tmp"))
+    for version in versions[:-keep]:
+        shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def publish(session_factory, state_dir: str = SHARED_STATE_DIR, model_dir: str = None) -> str:
+    from recommendation_state import SharedLikeGraph
+    from recvae_inference import new_version
+    from reranking import TrackFeatures
+    from search_index import SearchIndex
+    from track_sampler import TrackSampler
+
+    version = new_version()
+    final = os.path.join(state_dir, "versions", version)
+    tmp = final + ".tmp"
+    os.makedirs(tmp)
+    # Taken before the reads, so any like committed earlier is in the snapshot.
+    read_at = time.time()
+    db = session_factory()
+    try:
+        arrays = SharedLikeGraph.build(db)
+        search = SearchIndex()
+        search.load(db)
+        sampler = TrackSampler()
+        sampler.load(db)
+        features = TrackFeatures()
+        features.load(db)
+    finally:
+        db.close()
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+    search.save(tmp)
+    sampler.save(tmp)
+    features.save(tmp)
+    manifest = {
+        "format": 1,
+        "version": version,
+        "read_at": read_at,
+        "users": len(arrays["usernames"]),
+        "likes": len(arrays["user_items"]),
+        "model": _prepare_model(model_dir),
+    }
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(tmp, final)
+    _prune(state_dir)
+    return final
+
+
+def attach(path: str):
+    """Point this process's like graph, search index, sampler and features at a snapshot."""
+    global current
+    from recommendation_state import like_graph
+    from reranking import track_features
+    from search_index import search_index
+    from track_sampler import track_sampler
+
+    started = time.perf_counter()
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    like_graph.attach(path, manifest["read_at"])
+    search_index.attach(path)
+    track_sampler.attach(path)
+    track_features.attach(path)
+    current = manifest
+    print(f"Shared state {manifest['version']} attached ({manifest['users']} users, "
+          f"{manifest['likes']} likes) in {(time.perf_counter() - started) * 1000:.1f}ms.")
+
+
+def attach_latest(state_dir: str = SHARED_STATE_DIR) -> bool:
+    path = latest_snapshot(state_dir)
+    if not path or (current and path.endswith(current["version"])):
+        return False
+    attach(path)
+    return True
+
+
+def trusted_model():
+    return current.get("model") if current else None
+
+
+def watch(interval: float = SHARED_STATE_WATCH_SECONDS, state_dir: str = SHARED_STATE_DIR):
+    """Poll for newer snapshots from a daemon thread; also reloads a rebuilt item-kNN index."""
+    global _watcher
+    if _watcher or interval <= 0:
+        return
+    from item_knn import item_knn
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                attach_latest(state_dir)
+                item_knn.reload_if_newer()
+            except Exception as e:
+                print(f"Shared state refresh failed: {e}")
+
+    _watcher = threading.Thread(target=run, daemon=True)
+    _watcher.start()
+
+
+if __name__ == "__main__":
+    import argparse
+    from db_config import SessionLocal
+    from init_db import init_db
+
+    parser = argparse.ArgumentParser(description="Publish shared serving state for uvicorn workers.")
+    parser.add_argument("--state-dir", default=SHARED_STATE_DIR or "state")
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_DIR", "model"))
+    parser.add_argument("--interval", type=float, default=SHARED_STATE_REFRESH_SECONDS)
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+
+    from item_knn import item_knn
+    from recommendation_state import SharedLikeGraph
+
+    init_db()
+    while True:
+        started = time.perf_counter()
+        path = publish(SessionLocal, args.state_dir, args.model_dir)
+        print(f"Published {path} in {time.perf_counter() - started:.2f}s.")
+        # Rebuilt here when missing or older than ITEM_KNN_REFRESH_SECONDS; workers
+        # reload ITEM_KNN_PATH from their watcher.
+        item_knn.load()
+        if item_knn.stale():
+            graph = SharedLikeGraph()
+            graph.attach(path, 0.0)
+            item_knn.rebuild(graph)
+        if args.once:
+            break
+        time.sleep(args.interval)
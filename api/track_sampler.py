@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from db_models import Track
+
+SAMPLER_REFRESH_SECONDS = float(os.environ.get("SAMPLER_REFRESH_SECONDS", "300"))
+
+
+class TrackSampler:
+    """Random track ids drawn from an in-memory id array instead of the tracks table.
+
+    The arrays are reloaded after `invalidate()` or every SAMPLER_REFRESH_SECONDS, which
+    also picks up ingestion runs done by other processes. Attached from a shared_state
+    snapshot, the arrays are refreshed by the publisher instead.
+    """
+
+    def __init__(self, refresh_seconds: float = SAMPLER_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        # (ids, cumulative rank weights, loaded_at), swapped as one reference.
+        self._state = None
+        self.shared = False
+
+    def _build(self, rows):
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        ranks = np.fromiter((r[1] or 0 for r in rows), dtype=np.float64, count=len(rows))
+        # +1 keeps unranked tracks reachable when sampling by rank.
+        self._state = (ids, np.cumsum(ranks + 1), time.monotonic())
+        self.shared = False
+
+    @staticmethod
+    def _query():
+        # Id order, not heap order, so a seed draws the same page in every worker and
+        # across reloads.
+        return select(Track.id, Track.rank).order_by(Track.id)
+
+    def load(self, db: Session):
+        self._build(db.execute(self._query()).all())
+
+    async def load_async(self, db):
+        result = await db.execute(self._query())
+        self._build(result.all())
+
+    def save(self, path: str):
+        """Write the arrays as sampler_*.npy for attach() in other processes."""
+        ids, cumulative, _ = self._state
+        np.save(os.path.join(path, "sampler_ids.npy"), ids)
+        np.save(os.path.join(path, "sampler_cumulative.npy"), cumulative)
+
+    def attach(self, path: str):
+        def array(name):
+            return np.load(os.path.join(path, f"sampler_{name}.npy"), mmap_mode="r")
+
+        self._state = (array("ids"), array("cumulative"), time.monotonic())
+        self.shared = True
+
+    def stale(self) -> bool:
+        state = self._state
+        if state is not None and self.shared:
+            return False
+        return state is None or time.monotonic() - state[2] > self.refresh_seconds
+
+    def invalidate(self):
+        self._state = None
+
+    def _current(self, db: Session):
+        state = self._state
+        if self.stale():
+            with self._lock:
+                if self._state is state:
+                    self.load(db)
+                state = self._state
+        return state
+
+    def sample(self, db: Session, n: int, seed: int = None, weighted: bool = False):
+        return self.draw(self._current(db), n, seed, weighted)
+
+    async def sample_async(self, db, n: int, seed: int = None, weighted: bool = False):
+        if self.stale():
+            await self.load_async(db)
+        return self.draw(self._state, n, seed, weighted)
+
+    @staticmethod
+    def draw(state, n: int, seed: int = None, weighted: bool = False):
+        ids, cumulative, _ = state
+        n = min(n, len(ids))
+        if n == 0:
+            return []
+        rng = np.random.default_rng(seed)
+        if not weighted:
+            return ids[rng.choice(len(ids), size=n, replace=False)].tolist()
+
+        # Weighted draw without replacement: inverse-CDF lookups, redrawing duplicates.
+        picked = {}
+        while len(picked) < n:
+            draws = rng.random(2 * (n - len(picked))) * cumulative[-1]
+            for i in np.searchsorted(cumulative, draws, side="right").tolist():
+                picked.setdefault(i, None)
+                if len(picked) == n:
+                    break
+        return ids[list(picked)].tolist()
+
+
+track_sampler = TrackSampler()